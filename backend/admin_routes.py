@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse
+import os
+import hmac
+import logging
+from typing import Optional
+
+from profiler import SamplingProfiler, ProfilerBusy
+from chat_routes import slow_request_log
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = 120
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only with the X-Admin-Token matching ADMIN_TOKEN"""
+    expected = os.environ.get('ADMIN_TOKEN')
+    if not expected:
+        # Admin API is disabled unless a token is configured
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+admin_router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+# On-demand sampling profiler for the event loop
+sampling_profiler = SamplingProfiler()
+
+@admin_router.post("/profile", response_class=PlainTextResponse)
+async def run_profile(seconds: float = 10, interval_ms: float = 5):
+    """Sample the event loop for N seconds; returns folded stacks for flamegraph tools"""
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    
+    try:
+        profile = await sampling_profiler.profile(seconds, interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return PlainTextResponse(
+        profile,
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'}
+    )
+
+@admin_router.get("/slow-requests")
+async def get_slow_requests(limit: Optional[int] = None):
+    """Stage breakdowns of recent requests slower than SLOW_REQUEST_MS"""
+    return {
+        "threshold_ms": slow_request_log.threshold_ms,
+        "requests": slow_request_log.recent(limit),
+    }
@@ -1,7 +1,7 @@
 import os
+import time
 import asyncio
 from dotenv import load_dotenv
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 from typing import Dict, Any
 import logging
 
@@ -10,11 +10,28 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+class GenerationFailed(Exception):
+    """Raised when the provider call fails; carries the fallback text to show instead"""
+    
+    def __init__(self, fallback: str):
+        super().__init__(fallback)
+        self.fallback = fallback
+
 class AIService:
-    def __init__(self):
+    def __init__(self, stats=None):
         self.api_key = os.environ.get('EMERGENT_LLM_KEY')
+        self.stats = stats  # optional ModelLatencyStats
+        self._sdk = None
+    
+    def _get_sdk(self):
+        """Import the LLM SDK when a request first needs it; it is slow to import and not needed to boot"""
         if not self.api_key:
             raise ValueError("EMERGENT_LLM_KEY not found in environment variables")
+        if self._sdk is None:
+            from emergentintegrations.llm import chat as sdk
+            self._sdk = sdk
+            logger.info("LLM SDK loaded")
+        return self._sdk
     
     def _get_system_message(self, category: str) -> str:
         """Get specialized system message based on category"""
@@ -59,32 +76,63 @@ class AIService:
         return model_mapping.get(category, ("openai", "gpt-4o-mini"))
     
     async def generate_response(self, message: str, category: str, session_id: str) -> str:
-        """Generate AI response based on message and category"""
+        """Generate AI response based on message and category.
+        
+        Raises GenerationFailed with a fallback text when the provider call fails.
+        """
+        # Get system message and model for category
+        system_message = self._get_system_message(category)
+        provider, model = self._get_model_by_category(category)
+        started = time.perf_counter()
         try:
-            # Get system message and model for category
-            system_message = self._get_system_message(category)
-            provider, model = self._get_model_by_category(category)
-            
             # Initialize chat with appropriate settings
-            chat = LlmChat(
+            sdk = self._get_sdk()
+            chat = sdk.LlmChat(
                 api_key=self.api_key,
                 session_id=session_id,
                 system_message=system_message
             ).with_model(provider, model)
             
             # Create user message
-            user_message = UserMessage(text=message)
+            user_message = sdk.UserMessage(text=message)
             
             # Generate response
             logger.info(f"Sending message to {provider}/{model} for category: {category}")
             response = await chat.send_message(user_message)
             
+            if self.stats:
+                self.stats.record(f"{provider}/{model}", (time.perf_counter() - started) * 1000)
             return response
             
         except Exception as e:
             logger.error(f"Error generating AI response: {str(e)}")
-            # Fallback response
-            return self._get_fallback_response(category, str(e))
+            if self.stats:
+                self.stats.record(f"{provider}/{model}", (time.perf_counter() - started) * 1000, failed=True)
+            raise GenerationFailed(self._get_fallback_response(category, str(e))) from e
+    
+    def get_configured_models(self) -> list[tuple[str, str]]:
+        """List every provider/model pair used by some category"""
+        models = [self._get_model_by_category(category) for category in ("code", "analysis", "text")]
+        return list(dict.fromkeys(models))
+    
+    async def load_sdk(self):
+        """Import the LLM SDK in a worker thread so the event loop keeps serving meanwhile"""
+        if self._sdk is None:
+            await asyncio.to_thread(self._get_sdk)
+        return self._sdk
+    
+    async def probe_model(self, provider: str, model: str) -> None:
+        """Send a minimal request to check that a provider/model answers; raises on failure"""
+        if os.environ.get('HEALTH_PROBE_MODE', 'live') == 'stub':
+            return
+        
+        sdk = await self.load_sdk()
+        chat = sdk.LlmChat(
+            api_key=self.api_key,
+            session_id=f"health-probe-{provider}-{model}",
+            system_message="Reply with the single word: ok"
+        ).with_model(provider, model)
+        await chat.send_message(sdk.UserMessage(text="ping"))
     
     def _get_fallback_response(self, category: str, error: str) -> str:
         """Provide fallback response when AI is unavailable"""
@@ -97,6 +145,12 @@ class AIService:
         logger.warning(f"Using fallback response for category {category} due to error: {error}")
         return fallbacks.get(category, "Извините, сервис временно недоступен. Попробуйте позже.")
     
+    def resolve_category(self, message: str, category: str = None) -> str:
+        """Use the requested category, auto-detecting it when not provided or default"""
+        if category == "text" or not category:
+            return self.detect_category(message)
+        return category
+    
     def detect_category(self, message: str) -> str:
         """Automatically detect message category"""
         message_lower = message.lower()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Search index benchmark
+Builds the in-memory search index over a synthetic chat corpus and measures
+incremental insert throughput and query latency.
+
+Usage: python benchmarks/bench_search.py [messages] [queries]
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import ChatMessage
+from search_index import InMemorySearchIndex
+
+VOCABULARY = [
+    'python', 'javascript', 'react', 'regex', 'function', 'class', 'array', 'sorting',
+    'database', 'query', 'index', 'performance', 'error', 'exception', 'async', 'docker',
+    'функция', 'класс', 'массив', 'сортировка', 'регулярное', 'выражение', 'ошибка',
+    'оптимизация', 'производительность', 'база', 'данных', 'запрос', 'документация',
+    'тестирование', 'архитектура', 'безопасность', 'компонент', 'сервер', 'клиент',
+]
+FILLER = ['the', 'and', 'как', 'для', 'this', 'что', 'with', 'это', 'нужно', 'please', 'example']
+CATEGORIES = ['code', 'analysis', 'text']
+QUERIES = [
+    'regex', 'регулярное выражение', 'сортировка массива', 'python exception',
+    'оптимизация запросов базы данных', 'react component', 'ошибки безопасности',
+]
+
+
+def build_corpus(count: int):
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=30)
+
+    # Zipf-like word distribution: a long tail of rare identifiers behind common terms
+    words = FILLER + VOCABULARY + [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyzабвгдежзиклмнопрстуфхцчшы") for _ in range(rng.randint(4, 10)))
+        for _ in range(20_000)
+    ]
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(words)):
+        total += 1.0 / (rank + 1)
+        cum_weights.append(total)
+
+    for i in range(count):
+        yield ChatMessage(
+            session_id=f"session-{i // 20}",
+            type="user" if i % 2 == 0 else "ai",
+            content=" ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 60))),
+            category=CATEGORIES[i % 3],
+            timestamp=start + timedelta(seconds=i)
+        )
+
+
+async def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    index = InMemorySearchIndex()
+
+    print(f"📚 Indexing {message_count} messages...")
+    elapsed = 0.0
+    for message in build_corpus(message_count):
+        started = time.perf_counter()
+        index.add(message)
+        elapsed += time.perf_counter() - started
+    print(f"   {elapsed:.1f}s indexing, {message_count / elapsed:,.0f} messages/s, "
+          f"{len(index.postings)} terms")
+
+    for label, filters in [
+        ("no filters", {}),
+        ("category=code", {"category": "code"}),
+        ("single session", {"session_id": "session-7"}),
+    ]:
+        latencies = []
+        for i in range(query_count):
+            started = time.perf_counter()
+            await index.search(QUERIES[i % len(QUERIES)], limit=20, **filters)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"🔍 {label}: p50 {statistics.median(latencies):.1f}ms, p99 {p99:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+send_message latency benchmark
+Runs process_message against a fake provider and a fake database with fixed
+per-operation latencies, so the cost of the request pipeline can be compared
+between versions without MongoDB or LLM access.
+
+Usage: python benchmarks/bench_send_message.py [requests] [provider_ms] [db_ms]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chat_routes
+from models import ChatRequest
+from services import Services
+
+
+class FakeResult:
+    def __init__(self, matched_count: int = 0):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+
+
+class FakeCollection:
+    """Dict-backed collection where every call costs a fixed round trip"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.documents = {}
+
+    async def insert_one(self, document):
+        await asyncio.sleep(self.latency)
+        self.documents[document["id"]] = document
+        return FakeResult()
+
+    async def update_one(self, query, update, upsert: bool = False):
+        await asyncio.sleep(self.latency)
+        document = self.documents.get(query["id"])
+        if document is None and upsert:
+            self.documents[query["id"]] = dict(update.get("$setOnInsert", {}))
+            return FakeResult(0)
+        if document is None or document.get("deleted_at") is not None:
+            return FakeResult(0)
+        document.update(update.get("$set", {}))
+        return FakeResult(1)
+
+    async def find_one(self, query):
+        await asyncio.sleep(self.latency)
+        document = self.documents.get(query["id"])
+        if document is None or document.get("deleted_at") is not None:
+            return None
+        return document
+
+
+class FakeDatabase:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        collection = FakeCollection(self.latency)
+        setattr(self, name, collection)
+        return collection
+
+
+async def run(label: str, count: int, db: FakeDatabase, services: Services, reuse_session: bool):
+    session_id = None
+    if reuse_session:
+        response = await chat_routes.process_message(ChatRequest(message="start"), db, services)
+        session_id = response.session_id
+
+    latencies = []
+    for i in range(count):
+        request = ChatRequest(message=f"Напиши функцию сортировки #{i}", category="code", session_id=session_id)
+        started = time.perf_counter()
+        await chat_routes.process_message(request, db, services)
+        latencies.append((time.perf_counter() - started) * 1000)
+    # Let deferred writes finish before the next scenario
+    await asyncio.sleep(0.1)
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"⏱  {label}: mean {statistics.mean(latencies):.1f}ms, "
+          f"p50 {statistics.median(latencies):.1f}ms, p95 {p95:.1f}ms")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    provider_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000
+    db_latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+
+    async def fake_generate_response(message: str, category: str, session_id: str) -> str:
+        await asyncio.sleep(provider_delay)
+        return f"Ответ на: {message}"
+
+    db = FakeDatabase(db_latency)
+    services = Services(db)
+    services.ai_service.generate_response = fake_generate_response
+
+    print(f"🔧 provider {provider_delay * 1000:.0f}ms, db round trip {db_latency * 1000:.0f}ms, {count} requests")
+    await run("new session", count, db, services, reuse_session=False)
+    await run("existing session", count, db, services, reuse_session=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Worker cold-start benchmark
+Measures how long `import server` takes and how long a fresh uvicorn worker
+needs from process start to answering its first request (GET /api/).
+MongoDB and the LLM provider are not needed: startup does not wait for them.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_time() -> list:
+    """Cumulative import time of `server` and of each module it imports directly (ms)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # Nesting is shown by indentation: "server" at level 0, its imports at level 1
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$", line)
+        if match and len(match.group(2)) in (0, 2):
+            imports.append((int(match.group(1)) / 1000, match.group(3)))
+    return sorted(imports, reverse=True)
+
+
+def time_to_first_request(env: dict) -> float:
+    """Seconds from spawning a worker until GET /api/ answers"""
+    port = free_port()
+    started = time.perf_counter()
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if worker.poll() is not None:
+                raise RuntimeError("Worker exited during startup")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = {**os.environ, "HEALTH_PROBE_MODE": "stub"}
+
+    imports = import_time()
+    total = next((ms for ms, name in imports if name == "server"), 0.0)
+    print(f"📦 import server: {total:.0f}ms")
+    for ms, name in [item for item in imports if item[1] != "server"][:8]:
+        print(f"   {name}: {ms:.0f}ms")
+
+    samples = [time_to_first_request(env) * 1000 for _ in range(runs)]
+    print(f"🚀 cold start to first request ({runs} workers): "
+          f"median {statistics.median(samples):.0f}ms, max {max(samples):.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Worker scaling benchmark
+Starts serve.py with 1, 2, 4, ... workers (up to the available cores) and
+measures POST /api/chat/ throughput from keep-alive client processes, with
+the rate limiter off and then on, so the cost of the shared-memory table
+shows up next to the scaling.
+
+The server runs with a stub LLM SDK and an in-process mongomock database in
+every worker, so neither MongoDB nor an API key is needed. Each request
+passes a known API key and a session, so the limiter checks and charges two
+buckets, and a generation records two latency samples: six shared-table
+lock acquisitions per chat. Every worker counts how long ProcessLock.acquire
+kept its event loop waiting.
+
+Usage: python benchmarks/bench_workers.py [max_workers] [seconds] [provider_ms]
+"""
+
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+API_KEY = "bench-key"
+SESSIONS_PER_CLIENT = 4
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def post_chat(connection: http.client.HTTPConnection, body: dict) -> dict:
+    connection.request("POST", "/api/chat/", body=json.dumps(body), headers={
+        "Content-Type": "application/json",
+        "X-API-Key": API_KEY,
+    })
+    response = connection.getresponse()
+    payload = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"POST /api/chat/ returned {response.status}: {payload[:200]!r}")
+    return json.loads(payload)
+
+
+def client(port: int, seconds: float, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    # Sessions must exist, otherwise every request would create a new one
+    sessions = [
+        post_chat(connection, {"message": "start", "category": "text"})["session_id"]
+        for _ in range(SESSIONS_PER_CLIENT)
+    ]
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        post_chat(connection, {
+            "message": "Explain list comprehensions",
+            "category": "text",
+            "session_id": sessions[len(latencies) % len(sessions)],
+        })
+        latencies.append((time.perf_counter() - started) * 1000)
+    results.put(latencies)
+
+
+def read_lock_stats(directory: str):
+    acquires, waited_ms, max_ms = 0, 0.0, 0.0
+    for path in Path(directory).glob("*.json"):
+        stats = json.loads(path.read_text())
+        acquires += stats["acquires"]
+        waited_ms += stats["waited_ms"]
+        max_ms = max(max_ms, stats["max_ms"])
+    return acquires, waited_ms, max_ms
+
+
+def measure(workers: int, seconds: float, provider_ms: float, rate_limited: bool):
+    port = free_port()
+    stats_dir = tempfile.mkdtemp(prefix="bench-locks-")
+    env = {
+        **os.environ,
+        "RATE_LIMIT_ENABLED": "true" if rate_limited else "false",
+        "BENCH_PROVIDER_MS": str(provider_ms),
+        "BENCH_LOCK_STATS_DIR": stats_dir,
+    }
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(port)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=client, args=(port, seconds, results))
+            for _ in range(workers * 2)
+        ]
+        for process in clients:
+            process.start()
+        latencies = sorted(latency for _ in clients for latency in results.get())
+        for process in clients:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return latencies, read_lock_stats(stats_dir)
+
+
+def serve():
+    """Run serve.py with a stub SDK and mongomock; forked workers inherit the patches"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.update({
+        "MONGO_URL": "mongodb://unused",
+        "DB_NAME": "bench",
+        "EMERGENT_LLM_KEY": "bench",
+        "HEALTH_PROBE_MODE": "stub",
+        "RATE_LIMIT_API_KEYS": API_KEY,
+        # Large enough that the benchmark never gets a 429
+        "RATE_LIMIT_TEXT": "1000000000/1",
+    })
+    from types import SimpleNamespace
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    import ai_service
+    import database
+    import serve as serve_module
+    import shared_state
+
+    provider_delay = float(os.environ.get("BENCH_PROVIDER_MS", "0")) / 1000
+
+    class StubChat:
+        def __init__(self, **options):
+            pass
+
+        def with_model(self, provider, model):
+            return self
+
+        async def send_message(self, message):
+            await asyncio.sleep(provider_delay)
+            return f"Stub reply to: {message.text}"
+
+    stub_sdk = SimpleNamespace(LlmChat=StubChat, UserMessage=lambda text: SimpleNamespace(text=text))
+    ai_service.AIService._get_sdk = lambda self: stub_sdk
+
+    def get_db():
+        if database.db is None:
+            database.client = AsyncMongoMockClient()
+            database.db = database.client[os.environ["DB_NAME"]]
+        return database.db
+
+    database.get_db = get_db
+
+    # Time every shared-table lock acquisition; workers report when they exit
+    lock_stats = {"acquires": 0, "waited_ms": 0.0, "max_ms": 0.0}
+    acquire = shared_state.ProcessLock.acquire
+
+    def timed_acquire(self, timeout):
+        started = time.perf_counter()
+        try:
+            return acquire(self, timeout)
+        finally:
+            waited_ms = (time.perf_counter() - started) * 1000
+            lock_stats["acquires"] += 1
+            lock_stats["waited_ms"] += waited_ms
+            lock_stats["max_ms"] = max(lock_stats["max_ms"], waited_ms)
+
+    shared_state.ProcessLock.acquire = timed_acquire
+
+    run_worker = serve_module.run_worker
+
+    def reporting_worker(*args):
+        try:
+            run_worker(*args)
+        finally:
+            path = Path(os.environ["BENCH_LOCK_STATS_DIR"]) / f"{os.getpid()}.json"
+            path.write_text(json.dumps(lock_stats))
+
+    serve_module.run_worker = reporting_worker
+    sys.argv = ["serve.py"] + sys.argv[2:]
+    return serve_module.main()
+
+
+def report(label: str, latencies, seconds: float, lock_stats) -> float:
+    rps = len(latencies) / seconds
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    line = f"{label}: {rps:,.0f} req/s, p50 {statistics.median(latencies):.2f}ms, p99 {p99:.2f}ms"
+    acquires, waited_ms, max_ms = lock_stats
+    if acquires:
+        line += (f"; lock {acquires / len(latencies):.1f}x per chat, "
+                 f"{waited_ms * 1000 / len(latencies):.0f}µs waited per chat, max {max_ms:.2f}ms")
+    print(line)
+    return rps
+
+
+def main():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else cores
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    provider_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    counts = []
+    workers = 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    counts.append(max_workers)
+
+    print(f"🖥  {cores} cores available, {seconds:.0f}s per run, stub provider {provider_ms:.0f}ms")
+    baseline = None
+    for workers in counts:
+        latencies, lock_stats = measure(workers, seconds, provider_ms, rate_limited=False)
+        unlimited = report(f"⚙️  {workers} workers, no limiter", latencies, seconds, lock_stats)
+        baseline = baseline or unlimited
+        latencies, lock_stats = measure(workers, seconds, provider_ms, rate_limited=True)
+        limited = report(f"🔒 {workers} workers, rate limited", latencies, seconds, lock_stats)
+        print(f"   scaling {unlimited / baseline:.2f}x, limiter costs {(1 - limited / unlimited) * 100:.1f}% throughput")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        sys.exit(serve())
+    main()
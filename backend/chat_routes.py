@@ -1,97 +1,262 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import os
 import uuid
+import asyncio
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 
-from models import ChatRequest, ChatResponse, ChatMessage, ChatHistoryResponse, ChatSession
-from ai_service import AIService
+from models import ChatRequest, ChatResponse, ChatMessage, ChatHistoryResponse, ChatSession, BulkDeleteRequest, SearchResponse
 from database import get_database
+from services import Services, get_services
+from session_purger import ACTIVE_SESSION_FILTER
+from idempotency import IdempotencyConflict, request_fingerprint
+from ai_service import GenerationFailed
+from lifecycle import ServiceShuttingDown
+from profiler import SlowRequestLog, stage, timed, annotate
 
 logger = logging.getLogger(__name__)
 
 chat_router = APIRouter(prefix="/chat", tags=["chat"])
 
-# Initialize AI service
-ai_service = AIService()
+# Stage breakdowns of slow chat requests (exposed through the admin API)
+slow_request_log = SlowRequestLog()
 
-async def get_or_create_session(session_id: str = None, db: AsyncIOMotorDatabase = Depends(get_database)) -> str:
+async def get_or_create_session(
+    session_id: str = None,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    new_session_id: Optional[str] = None
+) -> str:
     """Get existing session or create new one"""
     if session_id:
-        # Check if session exists
-        session = await db.chat_sessions.find_one({"id": session_id})
-        if session:
-            # Update last activity
-            await db.chat_sessions.update_one(
-                {"id": session_id},
-                {"$set": {"updated_at": datetime.utcnow()}}
-            )
+        # Update last activity if the session exists (single round trip)
+        result = await db.chat_sessions.update_one(
+            {"id": session_id, **ACTIVE_SESSION_FILTER},
+            {"$set": {"updated_at": datetime.utcnow()}}
+        )
+        if result.matched_count:
             return session_id
     
     # Create new session
-    new_session_id = str(uuid.uuid4())
+    new_session_id = new_session_id or str(uuid.uuid4())
     session = ChatSession(id=new_session_id)
     await db.chat_sessions.insert_one(session.dict())
     return new_session_id
 
 @chat_router.post("/", response_model=ChatResponse)
+@slow_request_log.traced("send_message")
 async def send_message(
     request: ChatRequest,
+    idempotency_key: Optional[str] = Header(None),
+    services: Services = Depends(get_services),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Send a message to AI and get response"""
+    if not services.lifecycle_manager.accepting:
+        raise HTTPException(status_code=503, detail="Service is shutting down", headers={"Retry-After": "5"})
+    
+    key = idempotency_key or request.idempotency_key
+    if not key:
+        return await run_generation(request, db, services)
+    
+    # Retries with the same key attach to the original request instead of generating again
+    fingerprint = request_fingerprint(request.message, request.category, request.session_id)
+    owner = str(uuid.uuid4())
+    try:
+        with stage("idempotency_begin"):
+            stored_response = await services.idempotency_store.begin(key, fingerprint, owner)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        logger.error(f"Error checking idempotency key: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    
+    if stored_response is not None:
+        logger.info(f"Returning stored response for idempotency key {key}")
+        return ChatResponse(**stored_response)
+    
+    # Keep the claim fresh so a slow generation is not taken over by a retry
+    keep_alive = asyncio.create_task(services.idempotency_store.keep_alive(key, owner))
+    handed_off = False
     try:
-        # Get or create session
-        session_id = await get_or_create_session(request.session_id, db)
+        try:
+            response = await run_generation(request, db, services)
+        except Exception:
+            try:
+                await services.idempotency_store.abandon(key, owner)
+            except Exception as e:
+                logger.error(f"Error releasing idempotency key: {str(e)}")
+            raise
         
-        # Auto-detect category if not provided or is default
-        if request.category == "text" or not request.category:
-            detected_category = ai_service.detect_category(request.message)
-            category = detected_category
-        else:
-            category = request.category
+        if response._fallback:
+            # Release the key so a retry regenerates instead of replaying the fallback text
+            try:
+                await services.idempotency_store.abandon(key, owner)
+            except Exception as e:
+                logger.error(f"Error releasing idempotency key: {str(e)}")
+            return response
         
-        # Save user message
-        user_message = ChatMessage(
-            session_id=session_id,
-            type="user",
-            content=request.message,
-            category=category
+        # Retries keep waiting until the AI message is in history, then get this response
+        services.lifecycle_manager.spawn(
+            complete_when_persisted(key, owner, response, keep_alive, services), "idempotency completion"
         )
-        await db.chat_messages.insert_one(user_message.dict())
-        
-        # Generate AI response
-        logger.info(f"Generating AI response for category: {category}")
-        ai_response_text = await ai_service.generate_response(
-            message=request.message,
+        handed_off = True
+        return response
+    finally:
+        if not handed_off:
+            keep_alive.cancel()
+
+async def complete_when_persisted(
+    key: str,
+    owner: str,
+    response: ChatResponse,
+    keep_alive: asyncio.Task,
+    services: Services
+):
+    """Store the response for retries once the AI message write has landed.
+
+    If the write never lands the key is released instead, so a retry
+    regenerates rather than replaying an id that is not in history.
+    """
+    try:
+        try:
+            await response._ai_write
+        except Exception:
+            await services.idempotency_store.abandon(key, owner)
+            raise
+        await services.idempotency_store.complete(key, owner, response.dict())
+    finally:
+        keep_alive.cancel()
+
+async def run_generation(request: ChatRequest, db: AsyncIOMotorDatabase, services: Services) -> ChatResponse:
+    """Process a message as a tracked generation that survives client disconnects"""
+    try:
+        return await services.lifecycle_manager.run_generation(process_message(request, db, services))
+    except ServiceShuttingDown:
+        raise HTTPException(status_code=503, detail="Service is shutting down", headers={"Retry-After": "5"})
+
+async def persist_user_message(
+    request: ChatRequest,
+    category: str,
+    session_id: str,
+    create_session: bool,
+    db: AsyncIOMotorDatabase,
+    services: Services
+):
+    """Save the user message, creating its session first if it is new"""
+    if create_session:
+        with stage("session_insert"):
+            await get_or_create_session(None, db, new_session_id=session_id)
+    
+    user_message = ChatMessage(
+        session_id=session_id,
+        type="user",
+        content=request.message,
+        category=category
+    )
+    with stage("user_message_insert"):
+        await db.chat_messages.insert_one({
+            **user_message.dict(), **services.search_index.document_fields(user_message)
+        })
+        services.search_index.add(user_message)
+
+async def persist_ai_message(ai_message: ChatMessage, db: AsyncIOMotorDatabase, services: Services):
+    """Save the AI response, retrying with backoff; the client already has its id"""
+    attempts = int(os.environ.get('AI_WRITE_ATTEMPTS', '5'))
+    delay = float(os.environ.get('AI_WRITE_RETRY_DELAY', '0.2'))
+    document = {**ai_message.dict(), **services.search_index.document_fields(ai_message)}
+    for attempt in range(1, attempts + 1):
+        try:
+            # Upsert on the message id so a retry after an ambiguous failure cannot duplicate it
+            await db.chat_messages.update_one(
+                {"id": ai_message.id}, {"$setOnInsert": document}, upsert=True
+            )
+            break
+        except Exception as e:
+            if attempt == attempts:
+                logger.error(f"Giving up on AI message {ai_message.id} after {attempts} attempts: {str(e)}")
+                raise
+            logger.warning(f"Error saving AI message {ai_message.id} (attempt {attempt}): {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+    services.search_index.add(ai_message)
+
+async def generate_reply(message: str, category: str, session_id: str, services: Services) -> Tuple[str, bool]:
+    """Generate the AI reply; returns (text, fallback), with the fallback text if the provider failed"""
+    try:
+        return await services.ai_service.generate_response(
+            message=message,
             category=category,
             session_id=session_id
+        ), False
+    except GenerationFailed as e:
+        return e.fallback, True
+
+async def process_message(request: ChatRequest, db: AsyncIOMotorDatabase, services: Services) -> ChatResponse:
+    """Store the user message, generate the AI reply and store it"""
+    try:
+        # Auto-detect category if not provided or is default
+        category = services.ai_service.resolve_category(request.message, request.category)
+        annotate(category=category, session_id=request.session_id)
+        
+        # The provider call is labelled with the session the messages are stored
+        # under, so an existing session is confirmed first; a new one is known up front
+        if request.session_id:
+            with stage("session_upsert"):
+                session_id = await get_or_create_session(request.session_id, db, new_session_id=str(uuid.uuid4()))
+            create_session = False
+        else:
+            session_id = str(uuid.uuid4())
+            create_session = True
+        
+        # The provider call runs concurrently with storing the user message
+        persist_task = asyncio.create_task(
+            persist_user_message(request, category, session_id, create_session, db, services)
         )
+        logger.info(f"Generating AI response for category: {category}")
+        generate_task = asyncio.create_task(timed("generate_response", generate_reply(
+            request.message, category, session_id, services
+        )))
+        
+        try:
+            _, (ai_response_text, fallback) = await asyncio.gather(persist_task, generate_task)
+        except Exception:
+            # If the user message could not be stored, stop paying for a reply
+            # that would not be saved or returned
+            for task in (persist_task, generate_task):
+                task.cancel()
+            await asyncio.gather(persist_task, generate_task, return_exceptions=True)
+            raise
         
-        # Save AI response
         ai_message = ChatMessage(
             session_id=session_id,
             type="ai",
             content=ai_response_text,
             category=category
         )
-        await db.chat_messages.insert_one(ai_message.dict())
+        
+        # Save AI response off the critical path; shutdown flushes pending writes
+        ai_write = services.lifecycle_manager.spawn(persist_ai_message(ai_message, db, services), "AI message write")
         
         # Return response
-        return ChatResponse(
+        response = ChatResponse(
             id=ai_message.id,
             response=ai_response_text,
             category=category,
             timestamp=ai_message.timestamp,
             session_id=session_id
         )
+        response._fallback = fallback
+        response._ai_write = ai_write
+        return response
         
     except Exception as e:
         logger.error(f"Error in send_message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @chat_router.get("/history/{session_id}", response_model=ChatHistoryResponse)
+@slow_request_log.traced("get_chat_history")
 async def get_chat_history(
     session_id: str,
     limit: int = 50,
@@ -99,19 +264,23 @@ async def get_chat_history(
 ):
     """Get chat history for a session"""
     try:
-        # Verify session exists
-        session = await db.chat_sessions.find_one({"id": session_id})
+        annotate(session_id=session_id, limit=limit)
+        
+        # Verify session exists and is not deleted
+        with stage("session_lookup"):
+            session = await db.chat_sessions.find_one({"id": session_id, **ACTIVE_SESSION_FILTER})
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Get messages
         cursor = db.chat_messages.find(
-            {"session_id": session_id}
+            {"session_id": session_id}, {"search_terms": 0}
         ).sort("timestamp", 1).limit(limit)
         
         messages = []
-        async for message_doc in cursor:
-            messages.append(ChatMessage(**message_doc))
+        with stage("messages_query"):
+            async for message_doc in cursor:
+                messages.append(ChatMessage(**message_doc))
         
         return ChatHistoryResponse(messages=messages)
         
@@ -121,6 +290,52 @@ async def get_chat_history(
         logger.error(f"Error getting chat history: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; convert timezone-aware query values to match"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@chat_router.get("/search", response_model=SearchResponse)
+async def search_messages(
+    q: str,
+    category: Optional[str] = None,
+    session_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=100),
+    services: Services = Depends(get_services),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Full-text search across chat history"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query must not be empty")
+    
+    try:
+        # Over-fetch so that hits from deleted sessions can be dropped
+        results = await services.search_index.search(
+            q,
+            category=category,
+            session_id=session_id,
+            since=to_naive_utc(since),
+            until=to_naive_utc(until),
+            limit=limit * 2
+        )
+        
+        session_ids = list({result.message.session_id for result in results})
+        visible_sessions = set()
+        async for session_doc in db.chat_sessions.find(
+            {"id": {"$in": session_ids}, **ACTIVE_SESSION_FILTER}, {"id": 1}
+        ):
+            visible_sessions.add(session_doc["id"])
+        
+        results = [result for result in results if result.message.session_id in visible_sessions]
+        return SearchResponse(query=q, results=results[:limit])
+        
+    except Exception as e:
+        logger.error(f"Error searching messages: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @chat_router.get("/sessions")
 async def get_sessions(
     limit: int = 20,
@@ -128,7 +343,7 @@ async def get_sessions(
 ):
     """Get recent chat sessions"""
     try:
-        cursor = db.chat_sessions.find().sort("updated_at", -1).limit(limit)
+        cursor = db.chat_sessions.find(ACTIVE_SESSION_FILTER).sort("updated_at", -1).limit(limit)
         sessions = []
         async for session_doc in cursor:
             sessions.append(ChatSession(**session_doc))
@@ -140,19 +355,11 @@ async def get_sessions(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @chat_router.delete("/session/{session_id}")
-async def delete_session(
-    session_id: str,
-    db: AsyncIOMotorDatabase = Depends(get_database)
-):
-    """Delete a chat session and all its messages"""
+async def delete_session(session_id: str, services: Services = Depends(get_services)):
+    """Delete a chat session; its messages are purged in the background"""
     try:
-        # Delete messages
-        await db.chat_messages.delete_many({"session_id": session_id})
-        
-        # Delete session
-        result = await db.chat_sessions.delete_one({"id": session_id})
-        
-        if result.deleted_count == 0:
+        deleted = await services.session_purger.tombstone({"id": session_id})
+        if deleted == 0:
             raise HTTPException(status_code=404, detail="Session not found")
         
         return {"message": "Session deleted successfully"}
@@ -161,4 +368,37 @@ async def delete_session(
         raise
     except Exception as e:
         logger.error(f"Error deleting session: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@chat_router.post("/sessions/delete")
+async def bulk_delete_sessions(request: BulkDeleteRequest, services: Services = Depends(get_services)):
+    """Delete sessions by id and/or by age; messages are purged in the background"""
+    if not request.session_ids and request.older_than_days is None:
+        raise HTTPException(status_code=400, detail="Provide session_ids or older_than_days")
+    if request.older_than_days is not None and request.older_than_days < 0:
+        raise HTTPException(status_code=400, detail="older_than_days must be non-negative")
+    
+    try:
+        query = {}
+        if request.session_ids:
+            query["id"] = {"$in": request.session_ids}
+        if request.older_than_days is not None:
+            cutoff = datetime.utcnow() - timedelta(days=request.older_than_days)
+            query["updated_at"] = {"$lt": cutoff}
+        
+        deleted = await services.session_purger.tombstone(query)
+        return {"message": "Sessions deleted successfully", "deleted_count": deleted}
+        
+    except Exception as e:
+        logger.error(f"Error bulk deleting sessions: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@chat_router.get("/sessions/purge-status")
+async def get_purge_status(session_id: Optional[str] = None, services: Services = Depends(get_services)):
+    """Get progress of background message purging for deleted sessions"""
+    try:
+        return await services.session_purger.get_status(session_id)
+        
+    except Exception as e:
+        logger.error(f"Error getting purge status: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,16 +1,31 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Optional
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, created on first use so importing the app has no side effects
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
+
+def get_db() -> AsyncIOMotorDatabase:
+    """Return the database, creating the Motor client on first call"""
+    global client, db
+    if db is None:
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+    return db
+
+def close_client():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
 
 # Database dependency
 async def get_database():
-    return db
\ No newline at end of file
+    return get_db()
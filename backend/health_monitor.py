@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ai_service import AIService
+from shared_state import SharedTable, SharedTableBusy, Values
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class HealthMonitor:
+    """Background probes of MongoDB and the LLM providers, served from a cache.
+
+    Provider probes cost real requests, so workers sharing a table take turns:
+    the one that claims a round probes and publishes the outcome, and every
+    worker copies the published results into its own cache.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, ai_service: AIService, table: SharedTable):
+        self.db = db
+        self.ai_service = ai_service
+        self.table = table
+        self.db_interval = float(os.environ.get('HEALTH_DB_INTERVAL', '10'))
+        self.provider_interval = float(os.environ.get('HEALTH_PROVIDER_INTERVAL', '300'))
+        self.probe_timeout = float(os.environ.get('HEALTH_PROBE_TIMEOUT', '10'))
+        self.checks: Dict[str, Dict[str, Any]] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        """Start the probe loops on the running event loop"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._run(self.check_database, self.db_interval)),
+            asyncio.create_task(self._run_providers()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, check: Callable[[], Awaitable[None]], interval: float):
+        while True:
+            try:
+                await check()
+            except Exception as e:
+                logger.error(f"Health check failed unexpectedly: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def _run_providers(self):
+        if self.ai_service.api_key and os.environ.get('HEALTH_PROBE_MODE', 'live') != 'stub':
+            # Preload the SDK off the loop, so neither probes nor the first chat import it there
+            try:
+                await self.ai_service.load_sdk()
+            except Exception as e:
+                logger.error(f"Error loading LLM SDK: {str(e)}")
+        # Wake up as often as the database check to pick up rounds probed by other workers
+        tick = min(self.db_interval, self.provider_interval)
+        while True:
+            try:
+                if self._claim_provider_round():
+                    await self.check_providers()
+                self._load_shared_checks()
+            except SharedTableBusy as e:
+                logger.warning(f"Skipping provider health round: {str(e)}")
+            except Exception as e:
+                logger.error(f"Health check failed unexpectedly: {str(e)}")
+            await asyncio.sleep(tick)
+
+    def _claim_provider_round(self) -> bool:
+        """Take the next provider probe round unless another worker's round is still current"""
+        now = time.time()
+        claimed = False
+
+        def claim(values: Optional[Values]) -> Values:
+            nonlocal claimed
+            if values is not None and values[0] > now:
+                return values
+            claimed = True
+            return now + self.provider_interval, float(os.getpid())
+
+        self.table.update("health:round", claim)
+        return claimed
+
+    async def _probe(self, name: str, probe: Awaitable[Any], interval: float):
+        """Run one probe with a timeout and cache its outcome"""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe, timeout=self.probe_timeout)
+            status, error = "up", None
+        except asyncio.TimeoutError:
+            status, error = "down", f"Timed out after {self.probe_timeout}s"
+        except Exception as e:
+            status, error = "down", str(e)
+
+        if status == "down" and self.checks.get(name, {}).get("status") != "down":
+            logger.warning(f"Health check {name} is down: {error}")
+        self.checks[name] = {
+            "status": status,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            # Whole milliseconds, so the copy published to other workers compares equal
+            "checked_at": datetime.utcfromtimestamp(round(time.time(), 3)),
+            "interval": interval,
+            "error": error,
+        }
+
+    async def check_database(self):
+        await self._probe("database", self.db.command("ping"), self.db_interval)
+
+    async def check_providers(self):
+        names = [f"{provider}/{model}" for provider, model in self.ai_service.get_configured_models()]
+        await asyncio.gather(*(
+            self._probe(name, self.ai_service.probe_model(*name.split("/", 1)), self.provider_interval)
+            for name in names
+        ))
+        for name in names:
+            check = self.checks[name]
+            values = (
+                1.0 if check["status"] == "up" else 0.0,
+                check["latency_ms"],
+                (check["checked_at"] - EPOCH).total_seconds(),
+                float(os.getpid()),
+            )
+            self.table.update(f"health:{name}", lambda _: values)
+
+    def _load_shared_checks(self):
+        """Copy provider results published by other workers when newer than our own"""
+        for provider, model in self.ai_service.get_configured_models():
+            name = f"{provider}/{model}"
+            values = self.table.get(f"health:{name}")
+            if values is None:
+                continue
+            up, latency_ms, checked_at, pid = values
+            checked_at = EPOCH + timedelta(seconds=checked_at)
+            local = self.checks.get(name)
+            if local is not None and local["checked_at"] >= checked_at:
+                continue
+            self.checks[name] = {
+                "status": "up" if up else "down",
+                "latency_ms": latency_ms,
+                "checked_at": checked_at,
+                "interval": self.provider_interval,
+                "error": None if up else f"Probe failed in worker {int(pid)}",
+            }
+
+    def _current(self, name: str) -> Optional[Dict[str, Any]]:
+        """Cached check result, marked stale if its loop stopped reporting"""
+        check = self.checks.get(name)
+        if check is None:
+            return None
+        age = (datetime.utcnow() - check["checked_at"]).total_seconds()
+        if age > 3 * check["interval"] + self.probe_timeout:
+            return {**check, "status": "stale"}
+        return check
+
+    def summary(self) -> Dict[str, Any]:
+        """Short health report for load balancers and liveness probes"""
+        database = self._current("database")
+        providers = [
+            self._current(f"{provider}/{model}")
+            for provider, model in self.ai_service.get_configured_models()
+        ]
+
+        if database is None:
+            database_status = "unknown"
+        else:
+            database_status = "connected" if database["status"] == "up" else "disconnected"
+
+        provider_statuses = [check["status"] for check in providers if check is not None]
+        if not provider_statuses:
+            ai_status = "unknown"
+        elif all(status == "up" for status in provider_statuses):
+            ai_status = "ready"
+        elif any(status == "up" for status in provider_statuses):
+            ai_status = "degraded"
+        else:
+            ai_status = "unavailable"
+
+        return {
+            "status": "healthy" if database_status == "connected" else "unhealthy",
+            "database": database_status,
+            "ai_service": ai_status,
+            "checked_at": database["checked_at"] if database else None,
+        }
+
+    def details(self) -> Dict[str, Any]:
+        """Full cached report including per-provider latencies and errors"""
+        return {
+            **self.summary(),
+            "checks": {name: self._current(name) for name in self.checks},
+        }
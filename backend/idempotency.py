@@ -0,0 +1,139 @@
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key cannot be used for this request"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def request_fingerprint(*parts: Optional[str]) -> str:
+    """Hash the request fields that must match when a key is reused"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Shared record of idempotent requests, kept in MongoDB so every worker sees it"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.idempotency_keys
+        self.ttl = timedelta(seconds=int(os.environ.get('IDEMPOTENCY_TTL', '86400')))
+        # An in-progress record older than this is assumed to belong to a dead worker
+        self.lock_timeout = timedelta(seconds=float(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', '120')))
+        self.wait_timeout = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '60'))
+        self.poll_interval = float(os.environ.get('IDEMPOTENCY_POLL_INTERVAL', '0.5'))
+        # Without the unique index concurrent retries would both claim a key
+        self._ready = False
+        self._prepare_lock = asyncio.Lock()
+
+    async def prepare(self):
+        """Create the indexes; keys are refused until this has succeeded"""
+        async with self._prepare_lock:
+            if self._ready:
+                return
+            await self.collection.create_index("key", unique=True)
+            # Mongo removes records once expires_at has passed
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._ready = True
+
+    async def begin(self, key: str, fingerprint: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Claim a key for this request.
+
+        Returns None when the caller owns the key and must process the request,
+        or the stored response of the original request. ``owner`` identifies
+        the claim in later keep_alive/complete/abandon calls.
+        """
+        if not self._ready:
+            # Waits for (or retries) index creation started in the background at startup
+            try:
+                await self.prepare()
+            except Exception as e:
+                logger.error(f"Error preparing idempotency store: {str(e)}")
+                raise IdempotencyConflict(503, "Idempotency-Key cannot be processed right now, retry later")
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        while True:
+            now = datetime.utcnow()
+            try:
+                await self.collection.insert_one({
+                    "key": key,
+                    "fingerprint": fingerprint,
+                    "status": "in_progress",
+                    "owner": owner,
+                    "response": None,
+                    "locked_at": now,
+                    "expires_at": now + self.ttl,
+                })
+                return None
+            except DuplicateKeyError:
+                pass
+
+            record = await self.collection.find_one({"key": key})
+            if record is None:
+                # Expired or abandoned between insert and lookup; try again
+                continue
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyConflict(422, "Idempotency-Key was already used with a different request")
+            if record["status"] == "completed":
+                return record["response"]
+
+            # Take over a lock left behind by a worker that died mid-request
+            if record["locked_at"] < now - self.lock_timeout:
+                result = await self.collection.update_one(
+                    {"key": key, "status": "in_progress", "locked_at": record["locked_at"]},
+                    {"$set": {"owner": owner, "locked_at": now, "expires_at": now + self.ttl}}
+                )
+                if result.modified_count:
+                    logger.warning(f"Taking over stale idempotency key {key}")
+                    return None
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise IdempotencyConflict(409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_interval)
+
+    async def keep_alive(self, key: str, owner: str):
+        """Refresh locked_at until cancelled, so a slow request is not taken over as stale"""
+        interval = self.lock_timeout.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.collection.update_one(
+                    {"key": key, "owner": owner, "status": "in_progress"},
+                    {"$set": {"locked_at": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.error(f"Error refreshing idempotency key {key}: {str(e)}")
+                continue
+            if not result.modified_count:
+                logger.warning(f"Lost idempotency key {key} to another request")
+                return
+
+    async def complete(self, key: str, owner: str, response: Dict[str, Any]):
+        """Store the response so retries get it instead of a new generation"""
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"key": key, "owner": owner, "status": "in_progress"},
+            {"$set": {"status": "completed", "response": response, "expires_at": now + self.ttl}}
+        )
+        if not result.modified_count:
+            logger.warning(f"Idempotency key {key} was taken over, response not stored")
+
+    async def abandon(self, key: str, owner: str):
+        """Release a key after a failure so the client can retry"""
+        await self.collection.delete_one({"key": key, "owner": owner, "status": "in_progress"})
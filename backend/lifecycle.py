@@ -0,0 +1,126 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from typing import Any, Awaitable, Coroutine, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceShuttingDown(Exception):
+    """Raised when new work is submitted after shutdown has started"""
+
+
+class LifecycleManager:
+    """Tracks in-flight generations and background writes so shutdown can drain them"""
+
+    def __init__(self):
+        self.drain_timeout = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+        self.accepting = True
+        self._deadline: Optional[float] = None
+        self._generations: Set[asyncio.Task] = set()
+        self._background: Set[asyncio.Task] = set()
+        self.stats = {"drained": 0, "aborted": 0, "flushed": 0, "dropped": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._generations)
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._background)
+
+    def run_generation(self, coro: Coroutine[Any, Any, Any]) -> Awaitable[Any]:
+        """Run a generation as a tracked task.
+
+        The task is shielded so it still finishes and persists its result if
+        the client disconnects; shutdown waits for it up to the drain deadline.
+        """
+        if not self.accepting:
+            coro.close()
+            raise ServiceShuttingDown("Service is shutting down")
+        task = asyncio.create_task(coro)
+        self._generations.add(task)
+        task.add_done_callback(self._generations.discard)
+        return asyncio.shield(task)
+
+    def spawn(self, coro: Coroutine[Any, Any, Any], description: str = "background write") -> asyncio.Task:
+        """Run a write that nobody awaits; it is flushed before shutdown completes"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+
+        def _done(finished: asyncio.Task):
+            self._background.discard(finished)
+            if not finished.cancelled() and finished.exception() is not None:
+                logger.error(f"Error in {description}: {str(finished.exception())}")
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _wait(self, tasks: Set[asyncio.Task], deadline: float) -> Tuple[int, int]:
+        """Wait for tasks until the deadline, cancel the rest; returns (finished, cancelled)"""
+        pending = set(tasks)
+        if not pending:
+            return 0, 0
+        timeout = max(0.0, deadline - time.monotonic())
+        done, pending = await asyncio.wait(pending, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return len(done), len(pending)
+
+    def stop_accepting(self):
+        """Refuse new generations and start the drain deadline.
+
+        Called from the exit signal (see install_exit_handlers): the server
+        waits for open connections before running the lifespan shutdown, and
+        chats arriving meanwhile must not start new generations.
+        """
+        if self.accepting:
+            self.accepting = False
+            self._deadline = time.monotonic() + self.drain_timeout
+            logger.info(f"Shutdown requested, refusing new chats ({self.in_flight} in flight)")
+
+    def install_exit_handlers(self):
+        """Call stop_accepting as soon as the server gets SIGINT or SIGTERM.
+
+        serve.py does this in DrainingServer; under plain ``uvicorn server:app``
+        the lifespan calls this instead. uvicorn registers its handlers on the
+        loop before the lifespan starts, so they are wrapped, not replaced.
+        Plain uvicorn only bounds its wait for open connections when started
+        with --timeout-graceful-shutdown (serve.py passes SHUTDOWN_DRAIN_TIMEOUT).
+        """
+        loop = asyncio.get_running_loop()
+        # asyncio has no public way to read a registered handler
+        handlers = getattr(loop, "_signal_handlers", None) or {}
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            previous = handlers.get(sig)
+            if previous is None:
+                continue
+
+            def handle(previous: asyncio.Handle = previous):
+                self.stop_accepting()
+                previous._run()
+
+            loop.add_signal_handler(sig, handle)
+
+    async def shutdown(self) -> Dict[str, int]:
+        """Stop accepting chats, drain generations, then flush background writes"""
+        self.stop_accepting()
+        deadline = self._deadline
+        logger.info(
+            f"Draining {self.in_flight} in-flight generations and "
+            f"{self.pending_writes} background writes (deadline in {max(0.0, deadline - time.monotonic()):.1f}s)"
+        )
+
+        drained, aborted = await self._wait(self._generations, deadline)
+        # Finishing generations may have queued more writes, so flush after draining
+        flushed, dropped = await self._wait(self._background, deadline)
+
+        self.stats = {"drained": drained, "aborted": aborted, "flushed": flushed, "dropped": dropped}
+        logger.info(
+            f"Shutdown drain complete: {drained} drained, {aborted} aborted, "
+            f"{flushed} writes flushed, {dropped} writes dropped"
+        )
+        return self.stats
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, List, Optional
 from datetime import datetime
 import uuid
 
@@ -15,11 +15,13 @@ class ChatSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    deleted_at: Optional[datetime] = None  # set when the session is tombstoned
 
 class ChatRequest(BaseModel):
     message: str
     category: str = "text"
     session_id: Optional[str] = None
+    idempotency_key: Optional[str] = None  # alternative to the Idempotency-Key header
 
 class ChatResponse(BaseModel):
     id: str
@@ -27,6 +29,24 @@ class ChatResponse(BaseModel):
     category: str
     timestamp: datetime
     session_id: str
+    # Set when the provider failed and response holds the fallback text; not serialized
+    _fallback: bool = PrivateAttr(default=False)
+    # Background write of the AI message, awaited before the response is stored for retries
+    _ai_write: Optional[Any] = PrivateAttr(default=None)
 
 class ChatHistoryResponse(BaseModel):
-    messages: List[ChatMessage]
\ No newline at end of file
+    messages: List[ChatMessage]
+
+class BulkDeleteRequest(BaseModel):
+    session_ids: Optional[List[str]] = None
+    older_than_days: Optional[int] = None  # sessions not updated within this many days
+
+
+class SearchResult(BaseModel):
+    message: ChatMessage
+    score: float
+    snippet: str
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
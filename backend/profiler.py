@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack and aggregates it in folded format.
+
+    The output ("frame;frame;frame count" per line) loads directly into
+    flamegraph.pl, speedscope or inferno.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _sample(self, thread_id: int, seconds: float, interval: float) -> Counter:
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                counts[self._fold(frame)] += 1
+            del frame
+            time.sleep(interval)
+        return counts
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        """Sample the calling event loop for the given duration and return folded stacks"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            logger.info(f"Sampling profiler running for {seconds}s every {interval * 1000:.0f}ms")
+            counts = await asyncio.get_running_loop().run_in_executor(
+                None, self._sample, threading.get_ident(), seconds, interval
+            )
+        finally:
+            self._lock.release()
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+class RequestTrace:
+    """Timeline of named stages within one request; stages may overlap"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.utcnow()
+        self._start = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+        self.attributes: Dict[str, Any] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self, duration_ms: float, error: Optional[str]) -> Dict[str, Any]:
+        return {
+            "request": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(duration_ms, 1),
+            "error": error,
+            "attributes": self.attributes,
+            "stages": self.stages,
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request; a no-op outside a traced request"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start_ms = trace.elapsed_ms()
+    try:
+        yield
+    finally:
+        trace.stages.append({
+            "name": name,
+            "start_ms": round(start_ms, 1),
+            "duration_ms": round(trace.elapsed_ms() - start_ms, 1),
+        })
+
+
+async def timed(name: str, awaitable: Awaitable[T]) -> T:
+    """Await something as a named stage, e.g. inside a concurrently running task"""
+    with stage(name):
+        return await awaitable
+
+
+def annotate(**attributes: Any):
+    """Attach attributes (category, session id, ...) to the current request trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+class SlowRequestLog:
+    """Keeps stage breakdowns of requests slower than a threshold in a ring buffer"""
+
+    def __init__(self):
+        self.threshold_ms = float(os.environ.get('SLOW_REQUEST_MS', '2000'))
+        self.entries: deque = deque(maxlen=int(os.environ.get('SLOW_REQUEST_BUFFER', '100')))
+
+    @contextmanager
+    def trace(self, name: str) -> Iterator[RequestTrace]:
+        """Trace a request; stages recorded in child tasks land in the same trace"""
+        trace = RequestTrace(name)
+        token = _current_trace.set(trace)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            _current_trace.reset(token)
+            duration_ms = trace.elapsed_ms()
+            if duration_ms >= self.threshold_ms:
+                self.entries.append(trace.to_dict(duration_ms, error))
+                logger.warning(f"Slow request {name}: {duration_ms:.0f}ms")
+
+    def traced(self, name: str) -> Callable:
+        """Decorator tracing an async route handler; keeps its signature for FastAPI"""
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                with self.trace(name):
+                    return await handler(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Most recent slow requests first"""
+        entries = list(reversed(self.entries))
+        return entries[:limit] if limit else entries
@@ -0,0 +1,346 @@
+import os
+import json
+import ipaddress
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from shared_state import SharedTableBusy
+
+logger = logging.getLogger(__name__)
+
+# Requests per window (seconds) for each category; "analysis" uses the most expensive model
+DEFAULT_BUDGETS = {
+    "text": "30/60",
+    "code": "20/60",
+    "analysis": "10/60",
+}
+
+
+class Budget:
+    """Token bucket parameters: burst capacity and refill rate per second"""
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+
+    @classmethod
+    def parse(cls, spec: str) -> "Budget":
+        """Parse "<requests>/<seconds>", e.g. "20/60" """
+        requests, seconds = spec.split("/")
+        return cls(float(requests), float(requests) / float(seconds))
+
+
+def load_budgets() -> Dict[str, Budget]:
+    """Category budgets, overridable with RATE_LIMIT_<CATEGORY>=<requests>/<seconds>"""
+    return {
+        category: Budget.parse(os.environ.get(f"RATE_LIMIT_{category.upper()}", default))
+        for category, default in DEFAULT_BUDGETS.items()
+    }
+
+
+class InMemoryBucketStore:
+    """Per-process token buckets; limits are per worker"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def peek(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        """Seconds until the bucket can pay cost (0 if it can now), without taking anything"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (budget.capacity, now))
+        tokens = min(budget.capacity, tokens + (now - updated) * budget.refill_rate)
+        return 0.0 if tokens >= cost else (cost - tokens) / budget.refill_rate
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        """Take tokens from a bucket; returns 0 if allowed, else seconds until allowed"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (budget.capacity, now))
+        tokens = min(budget.capacity, tokens + (now - updated) * budget.refill_rate)
+
+        if tokens >= cost:
+            tokens -= cost
+            retry_after = 0.0
+        else:
+            retry_after = (cost - tokens) / budget.refill_rate
+
+        self.buckets[key] = (tokens, now)
+        # Least recently used buckets are the ones most likely to be full again
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+
+class SharedBucketStore:
+    """Token buckets in the shared-memory table, shared by workers forked from serve.py"""
+
+    def __init__(self, table):
+        self.table = table
+
+    async def peek(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        now = time.time()
+        try:
+            values = self.table.get(f"bucket:{key}")
+        except SharedTableBusy as e:
+            # Fail open rather than stall the event loop behind another worker
+            logger.warning(f"Skipping rate limit check: {str(e)}")
+            return 0.0
+        tokens, updated = values[:2] if values else (budget.capacity, now)
+        tokens = min(budget.capacity, tokens + max(0.0, now - updated) * budget.refill_rate)
+        return 0.0 if tokens >= cost else (cost - tokens) / budget.refill_rate
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        now = time.time()
+        retry_after = 0.0
+
+        def refill_and_take(values):
+            nonlocal retry_after
+            tokens, updated = values[:2] if values else (budget.capacity, now)
+            tokens = min(budget.capacity, tokens + max(0.0, now - updated) * budget.refill_rate)
+            if tokens >= cost:
+                return tokens - cost, now
+            retry_after = (cost - tokens) / budget.refill_rate
+            return tokens, now
+
+        try:
+            self.table.update(f"bucket:{key}", refill_and_take)
+        except SharedTableBusy as e:
+            logger.warning(f"Skipping rate limit check: {str(e)}")
+            return 0.0
+        return retry_after
+
+
+class MongoBucketStore:
+    """Token buckets in a MongoDB collection, shared by all workers"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.rate_limits
+
+    async def prepare(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def peek(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        bucket = await self.collection.find_one({"_id": key})
+        if bucket is None:
+            return 0.0
+        elapsed = (datetime.utcnow() - bucket["updated_at"]).total_seconds()
+        tokens = min(budget.capacity, bucket["tokens"] + max(0.0, elapsed) * budget.refill_rate)
+        return 0.0 if tokens >= cost else (cost - tokens) / budget.refill_rate
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        now = datetime.utcnow()
+        # Time for an empty bucket to refill; idle buckets expire after that
+        ttl = timedelta(seconds=budget.capacity / budget.refill_rate)
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+
+        # Refill, check and consume in a single atomic update
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [
+                        budget.capacity,
+                        {"$add": [
+                            {"$ifNull": ["$tokens", budget.capacity]},
+                            {"$multiply": [elapsed_seconds, budget.refill_rate]}
+                        ]}
+                    ]},
+                    "updated_at": now,
+                    "expires_at": now + ttl,
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / budget.refill_rate
+
+
+class RateLimiter:
+    """Checks chat requests against per-client and per-session category budgets"""
+
+    def __init__(self, store, budgets: Dict[str, Budget], detect_category: Callable[[str, str], str]):
+        self.store = store
+        self.budgets = budgets
+        self.detect_category = detect_category
+        # X-Forwarded-For is client-controlled, so it is only used when a known proxy sets it
+        self.trust_proxy = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+        # Number of trusted proxies in front of the app; each appends one hop on the right
+        self.proxy_hops = max(1, int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1')))
+        # Keys issued to API clients; unknown keys are limited by IP like anonymous callers
+        self.api_keys = frozenset(
+            key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()
+        )
+        self._warned_proxy = False
+
+    async def prepare(self):
+        if hasattr(self.store, "prepare"):
+            await self.store.prepare()
+
+    def client_ip(self, scope: Scope, headers: Headers) -> str:
+        """Client address, taken from the hop added by the outermost trusted proxy"""
+        forwarded = headers.get("x-forwarded-for")
+        if self.trust_proxy and forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            if hops:
+                # Entries left of the trusted hops were written by the client and can be forged
+                return hops[max(0, len(hops) - self.proxy_hops)]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def client_key(self, scope: Scope, headers: Headers) -> Optional[str]:
+        """Identify the caller by a known API key or client IP; None if the caller is unknown.
+
+        Without RATE_LIMIT_TRUST_PROXY a private or loopback peer is taken to
+        be a proxy (e.g. the preview ingress), and all users behind it would
+        share its address, so such requests get no client bucket.
+        """
+        api_key = headers.get("x-api-key")
+        if api_key and api_key in self.api_keys:
+            return f"key:{api_key}"
+        if not self.trust_proxy and self._behind_proxy(scope):
+            return None
+        return f"ip:{self.client_ip(scope, headers)}"
+
+    def _behind_proxy(self, scope: Scope) -> bool:
+        client = scope.get("client")
+        if not client:
+            return True
+        try:
+            address = ipaddress.ip_address(client[0])
+        except ValueError:
+            return True
+        if (address.is_private or address.is_loopback) and not self._warned_proxy:
+            self._warned_proxy = True
+            logger.warning(
+                "Chat requests arrive from a private address but RATE_LIMIT_TRUST_PROXY is off; "
+                "limiting them per session only"
+            )
+        return address.is_private or address.is_loopback
+
+    async def check(self, scope: Scope, headers: Headers, payload: dict) -> Optional[Tuple[str, float]]:
+        """Return (scope, retry_after) for the first exhausted bucket, or None if allowed"""
+        message = payload.get("message") or ""
+        category = self.detect_category(message, payload.get("category"))
+        budget = self.budgets.get(category, self.budgets["text"])
+
+        keys: List[Tuple[str, str]] = []
+        client_key = self.client_key(scope, headers)
+        if client_key:
+            keys.append(("client", client_key))
+        if payload.get("session_id"):
+            keys.append(("session", f"session:{payload['session_id']}"))
+
+        # Check every bucket first so a rejected request is not charged to any of them
+        for limit_scope, key in keys:
+            retry_after = await self.store.peek(f"{key}:{category}", budget)
+            if retry_after > 0:
+                return limit_scope, retry_after
+
+        for limit_scope, key in keys:
+            retry_after = await self.store.take(f"{key}:{category}", budget)
+            if retry_after > 0:
+                # Lost a race with a concurrent request between the check and the take
+                return limit_scope, retry_after
+        return None
+
+
+def create_rate_limiter(
+    db: AsyncIOMotorDatabase,
+    detect_category: Callable[[str, str], str],
+    shared_table=None
+) -> RateLimiter:
+    """Create the limiter with the store selected by RATE_LIMIT_BACKEND (memory, shared or mongo).
+
+    Defaults to the shared-memory table when running under serve.py, else per-process memory.
+    """
+    backend = os.environ.get('RATE_LIMIT_BACKEND', 'shared' if shared_table is not None else 'memory')
+    if backend == 'mongo':
+        store = MongoBucketStore(db)
+    elif backend == 'shared':
+        if shared_table is None:
+            raise ValueError("RATE_LIMIT_BACKEND=shared requires running under serve.py")
+        store = SharedBucketStore(shared_table)
+    elif backend == 'memory':
+        store = InMemoryBucketStore()
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return RateLimiter(store, load_budgets(), detect_category)
+
+
+class RateLimitMiddleware:
+    """Rejects over-budget chat requests with 429 before any route, DB or LLM work"""
+
+    def __init__(self, app: ASGIApp, paths: Tuple[str, ...] = ("/api/chat/", "/api/chat")):
+        self.app = app
+        self.paths = paths
+        self.enabled = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            not self.enabled
+            or scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # Buffer the body to read the category and session, then replay it to the app
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                await self.app(scope, receive, send)
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+
+        # The limiter is created with the other services in the app lifespan
+        services = getattr(scope["app"].state, "services", None)
+        if isinstance(payload, dict) and services is not None:
+            try:
+                rejected = await services.rate_limiter.check(scope, Headers(scope=scope), payload)
+            except Exception as e:
+                # Fail open: a broken limiter store must not take the chat down
+                logger.error(f"Error checking rate limit: {str(e)}")
+                rejected = None
+
+            if rejected:
+                limit_scope, retry_after = rejected
+                response = JSONResponse(
+                    {"detail": "Rate limit exceeded", "scope": limit_scope},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, round(retry_after)))}
+                )
+                await response(scope, receive, send)
+                return
+
+        body_sent = False
+
+        async def replay() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
@@ -0,0 +1,366 @@
+import os
+import re
+import math
+import heapq
+import logging
+from collections import defaultdict
+from itertools import islice
+from functools import lru_cache
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from models import ChatMessage, SearchResult
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[0-9a-zа-яё_]+", re.IGNORECASE)
+
+STOP_WORDS = {
+    # English
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what', 'with',
+    # Russian
+    'а', 'в', 'во', 'да', 'для', 'до', 'же', 'за', 'и', 'из', 'или', 'как', 'к', 'ко',
+    'ли', 'на', 'не', 'но', 'о', 'об', 'от', 'по', 'с', 'со', 'так', 'то', 'у', 'что', 'это',
+}
+
+# Inflection endings stripped to get a prefix stem, longest first
+RU_ENDINGS = sorted([
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей', 'ий', 'ый', 'ая',
+    'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ию',
+    'ия', 'ть', 'ет', 'ит', 'ют', 'ут', 'ат', 'ят', 'ешь', 'ишь', 'ла', 'ло', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+EN_ENDINGS = ['ings', 'ing', 'ies', 'ed', 'es', 's', 'ly']
+MIN_STEM_LENGTH = 3
+
+SNIPPET_LENGTH = 160
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Strip a common Russian or English inflection ending from a lowercase word"""
+    endings = RU_ENDINGS if re.search('[а-я]', word) else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized, stemmed search terms (Russian and English)"""
+    terms = []
+    for word in WORD_RE.findall(text.lower().replace('ё', 'е')):
+        if word in STOP_WORDS:
+            continue
+        terms.append(stem(word))
+    return terms
+
+
+def make_snippet(content: str, terms: Iterable[str], length: int = SNIPPET_LENGTH) -> str:
+    """Cut a window of the message around the first matching term"""
+    if len(content) <= length:
+        return content
+
+    content_lower = content.lower().replace('ё', 'е')
+    positions = [pos for pos in (content_lower.find(term) for term in terms) if pos >= 0]
+    if not positions:
+        return content[:length].rstrip() + "…"
+
+    start = max(0, min(positions) - length // 4)
+    end = min(len(content), start + length)
+    start = max(0, end - length)
+    snippet = content[start:end].strip()
+    if start > 0:
+        snippet = "…" + snippet
+    if end < len(content):
+        snippet += "…"
+    return snippet
+
+
+class SearchIndex:
+    """Common interface for chat message search backends"""
+
+    async def prepare(self):
+        """Build or verify the index when the app starts"""
+
+    def document_fields(self, message: ChatMessage) -> Dict[str, str]:
+        """Extra fields stored with a message for this backend to search on"""
+        return {}
+
+    def add(self, message: ChatMessage):
+        """Index a newly inserted message"""
+
+    def remove_session(self, session_id: str):
+        """Forget all messages of a purged session"""
+
+    async def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        session_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 20,
+    ) -> List[SearchResult]:
+        raise NotImplementedError
+
+
+class MongoTextSearchIndex(SearchIndex):
+    """Search backed by a MongoDB text index on chat_messages.search_terms.
+
+    Messages mix Russian and English, which no single Mongo text language
+    stems correctly, so search_terms holds the output of tokenize() and the
+    index is built with language 'none' (no further stemming or stop words).
+    """
+
+    index_name = "search_terms_text"
+    backfill_batch_size = 500
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    def document_fields(self, message: ChatMessage) -> Dict[str, str]:
+        return {"search_terms": " ".join(tokenize(message.content))}
+
+    async def prepare(self):
+        collection = self.db.chat_messages
+        # A collection holds a single text index; drop the old per-language one on content
+        if "content_text" in await collection.index_information():
+            await collection.drop_index("content_text")
+        # Mongo keeps the text index up to date on every insert
+        await collection.create_index(
+            [("search_terms", "text")],
+            name=self.index_name,
+            default_language="none"
+        )
+
+        # Messages stored before search_terms existed
+        backfilled = 0
+        while True:
+            batch = await collection.find(
+                {"search_terms": {"$exists": False}}, {"id": 1, "content": 1}
+            ).limit(self.backfill_batch_size).to_list(self.backfill_batch_size)
+            if not batch:
+                break
+            await collection.bulk_write([
+                UpdateOne(
+                    {"_id": message_doc["_id"]},
+                    {"$set": {"search_terms": " ".join(tokenize(message_doc.get("content", "")))}}
+                )
+                for message_doc in batch
+            ])
+            backfilled += len(batch)
+        if backfilled:
+            logger.info(f"Added search terms to {backfilled} existing messages")
+
+    async def search(self, query, category=None, session_id=None, since=None, until=None, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        mongo_query = {"$text": {"$search": " ".join(terms)}}
+        if category:
+            mongo_query["category"] = category
+        if session_id:
+            mongo_query["session_id"] = session_id
+        if since or until:
+            mongo_query["timestamp"] = {}
+            if since:
+                mongo_query["timestamp"]["$gte"] = since
+            if until:
+                mongo_query["timestamp"]["$lte"] = until
+
+        cursor = self.db.chat_messages.find(
+            mongo_query, {"score": {"$meta": "textScore"}, "search_terms": 0}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+
+        results = []
+        async for message_doc in cursor:
+            score = message_doc.pop("score", 0.0)
+            message = ChatMessage(**message_doc)
+            results.append(SearchResult(
+                message=message,
+                score=score,
+                snippet=make_snippet(message.content, terms)
+            ))
+        return results
+
+
+class _IndexedMessage:
+    """Compact copy of a message kept by the in-memory index"""
+    __slots__ = ("id", "session_id", "type", "content", "category", "timestamp", "length")
+
+    def __init__(self, message: ChatMessage, length: int):
+        self.id = message.id
+        self.session_id = message.session_id
+        self.type = message.type
+        self.content = message.content
+        self.category = message.category
+        self.timestamp = message.timestamp
+        self.length = length
+
+    def to_message(self) -> ChatMessage:
+        return ChatMessage(
+            id=self.id,
+            session_id=self.session_id,
+            type=self.type,
+            content=self.content,
+            category=self.category,
+            timestamp=self.timestamp
+        )
+
+
+class InMemorySearchIndex(SearchIndex):
+    """In-process inverted index with BM25 ranking, updated incrementally on insert.
+
+    Single-process only: each process loads its own copy of the collection
+    and only sees messages inserted through it, so serve.py refuses this
+    backend with more than one worker.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, db: Optional[AsyncIOMotorDatabase] = None):
+        self.db = db
+        # Scoring runs on the event loop, so common terms only score this many messages
+        self.max_candidates = int(os.environ.get('SEARCH_MAX_CANDIDATES', '20000'))
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.documents: Dict[str, _IndexedMessage] = {}
+        self.session_documents: Dict[str, Set[str]] = defaultdict(set)
+        self.total_length = 0
+
+    async def prepare(self):
+        """Load existing messages of visible sessions from the database"""
+        if self.db is None:
+            return
+        active_sessions = set()
+        async for session_doc in self.db.chat_sessions.find({"deleted_at": None}, {"id": 1}):
+            active_sessions.add(session_doc["id"])
+
+        async for message_doc in self.db.chat_messages.find():
+            if message_doc["session_id"] not in active_sessions:
+                continue
+            message_doc.pop("_id", None)
+            self.add(ChatMessage(**message_doc))
+        logger.info(f"Search index loaded with {len(self.documents)} messages")
+
+    def add(self, message: ChatMessage):
+        if message.id in self.documents:
+            return
+        terms = tokenize(message.content)
+        for term in terms:
+            postings = self.postings[term]
+            postings[message.id] = postings.get(message.id, 0) + 1
+
+        self.documents[message.id] = _IndexedMessage(message, len(terms))
+        self.session_documents[message.session_id].add(message.id)
+        self.total_length += len(terms)
+
+    def remove_session(self, session_id: str):
+        for message_id in self.session_documents.pop(session_id, ()):
+            indexed = self.documents.pop(message_id)
+            self.total_length -= indexed.length
+            for term in set(tokenize(indexed.content)):
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(message_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def _matches(self, message: _IndexedMessage, category, session_id, since, until) -> bool:
+        if category and message.category != category:
+            return False
+        if session_id and message.session_id != session_id:
+            return False
+        if since and message.timestamp < since:
+            return False
+        if until and message.timestamp > until:
+            return False
+        return True
+
+    async def search(self, query, category=None, session_id=None, since=None, until=None, limit=20):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.documents:
+            return []
+
+        total_docs = len(self.documents)
+        average_length = self.total_length / total_docs or 1.0
+
+        # Restrict candidates up front when searching a single session
+        allowed: Optional[Set[str]] = None
+        if session_id:
+            allowed = self.session_documents.get(session_id, set())
+
+        # BM25 length normalization: k1 * (1 - b + b * length / average_length)
+        documents = self.documents
+        norm_base = self.k1 * (1 - self.b)
+        norm_scale = self.k1 * self.b / average_length
+
+        # Rarest terms first: they weigh most and pick the candidates that common terms add to
+        term_postings = sorted(
+            ((term, self.postings[term]) for term in terms if self.postings.get(term)),
+            key=lambda item: len(item[1])
+        )
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term, postings in term_postings:
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            weight = idf * (self.k1 + 1)
+            if allowed is not None:
+                candidates = postings.keys() & allowed
+            elif len(scores) + len(postings) <= self.max_candidates:
+                candidates = postings
+            else:
+                # Past the cap, only the newest matching messages become new candidates
+                candidates = [message_id for message_id in scores if message_id in postings]
+                room = self.max_candidates - len(scores)
+                if room > 0:
+                    candidates.extend(islice(
+                        (
+                            message_id for message_id in reversed(postings)
+                            if message_id not in scores
+                            and self._matches(documents[message_id], category, session_id, since, until)
+                        ),
+                        room
+                    ))
+            for message_id in candidates:
+                tf = postings[message_id]
+                norm = tf + norm_base + norm_scale * documents[message_id].length
+                scores[message_id] += weight * tf / norm
+
+        ranked: List[Tuple[float, str]] = heapq.nlargest(
+            limit,
+            (
+                (score, message_id) for message_id, score in scores.items()
+                if self._matches(self.documents[message_id], category, session_id, since, until)
+            )
+        )
+
+        results = []
+        for score, message_id in ranked:
+            message = self.documents[message_id].to_message()
+            results.append(SearchResult(
+                message=message,
+                score=round(score, 4),
+                snippet=make_snippet(message.content, terms)
+            ))
+        return results
+
+
+SEARCH_BACKENDS: Dict[str, Callable[[AsyncIOMotorDatabase], SearchIndex]] = {
+    "mongo": MongoTextSearchIndex,
+    "memory": InMemorySearchIndex,
+}
+
+
+def create_search_index(db: AsyncIOMotorDatabase) -> SearchIndex:
+    """Create the search backend selected by SEARCH_BACKEND (mongo or memory)"""
+    backend = os.environ.get('SEARCH_BACKEND', 'mongo')
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown SEARCH_BACKEND: {backend}")
+    return SEARCH_BACKENDS[backend](db)
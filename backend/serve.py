@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Pre-forking server for the AI Coder backend
+Binds the listening socket and creates the shared-memory table once, then
+forks one uvicorn worker per available core. Workers share rate-limit
+buckets and per-model latency stats through the table, and /api/metrics
+reports them aggregated across workers.
+
+Usage: python serve.py [--host 0.0.0.0] [--port 8001] [--workers N] [--no-pin]
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+import uvicorn
+
+import shared_state
+
+logger = logging.getLogger("serve")
+
+
+def available_cores() -> List[int]:
+    """CPU cores this process may run on (respects taskset/cgroup affinity)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run server:app with pre-forked workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "0")),
+                        help="number of workers (default: one per available core)")
+    parser.add_argument("--no-pin", dest="pin", action="store_false",
+                        help="do not pin each worker to its own core")
+    parser.add_argument("--shared-slots", type=int, default=65536,
+                        help="records in the shared-memory table")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that stops accepting chats as soon as the exit signal arrives.
+
+    uvicorn runs the lifespan shutdown only after open connections have
+    finished, so the drain has to start here rather than in the lifespan.
+    """
+
+    def handle_exit(self, sig, frame):
+        services = getattr(self.config.app.state, "services", None)
+        if services is not None:
+            services.lifecycle_manager.stop_accepting()
+        super().handle_exit(sig, frame)
+
+
+def run_worker(index: int, sock: socket.socket, cores: List[int], args):
+    if args.pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cores[index % len(cores)]})
+
+    from server import app
+
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        lifespan="on",
+        # Bounds the wait for open connections; the lifespan drain shares the same deadline
+        timeout_graceful_shutdown=float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+    )
+    DrainingServer(config).run(sockets=[sock])
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    cores = available_cores()
+    workers = args.workers or len(cores)
+    if workers > 1 and os.environ.get("SEARCH_BACKEND", "mongo") == "memory":
+        # Each worker would hold its own partial index and answer differently
+        logger.error("SEARCH_BACKEND=memory is single-process only; use mongo or --workers 1")
+        return 2
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Accepted connections inherit this; without it keep-alive responses stall on delayed ACKs
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Shared state must exist before forking so every worker maps the same memory
+    shared_state.create_shared_table(args.shared_slots)
+
+    # Import the app once; importing has no side effects, services start per worker
+    import server  # noqa: F401
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                run_worker(index, sock, cores, args)
+            except Exception:
+                logger.exception(f"Worker {index} crashed")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Serving on {args.host}:{args.port} with {workers} workers (cores: {cores})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            time.sleep(1)
+            spawn(index)
+
+    logger.info("All workers stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
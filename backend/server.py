@@ -1,18 +1,42 @@
-from fastapi import FastAPI, APIRouter
+import time
+
+# Measured from the first import so startup logs show the worker's cold-start time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, Depends, HTTPException
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # Import database
-from database import db, client
+from database import get_db, close_client
+from services import Services, get_services
+from shared_state import SharedTableBusy
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("AI Coder Backend starting up...")
+    logger.info(f"Database: {os.environ['DB_NAME']}")
+    services = Services(get_db())
+    app.state.services = services
+    await services.start()
+    services.lifecycle_manager.install_exit_handlers()
+    logger.info(f"AI Coder Backend ready in {(time.perf_counter() - IMPORT_STARTED) * 1000:.0f}ms")
+    
+    yield
+    
+    await services.stop()
+    close_client()
+    logger.info("AI Coder Backend shut down")
+
 # Create the main app without a prefix
-app = FastAPI(title="AI Coder Backend", version="1.0.0")
+app = FastAPI(title="AI Coder Backend", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -23,23 +47,44 @@ async def root():
     return {"message": "AI Coder Backend is running!", "status": "healthy"}
 
 @api_router.get("/health")
-async def health_check():
+async def health_check(services: Services = Depends(get_services)):
+    """Cached health summary; probes run in the background"""
+    return services.health_monitor.summary()
+
+@api_router.get("/health/deep")
+async def deep_health_check(services: Services = Depends(get_services)):
+    """Cached per-dependency health with latencies and last errors"""
+    return services.health_monitor.details()
+
+@api_router.get("/metrics")
+async def metrics(services: Services = Depends(get_services)):
+    """Per-model latency and per-worker generation counts (across workers under serve.py)"""
     try:
-        # Test database connection
-        await db.list_collection_names()
-        return {"status": "healthy", "database": "connected", "ai_service": "ready"}
-    except Exception as e:
-        return {"status": "unhealthy", "error": str(e)}
+        snapshot = services.model_stats.snapshot()
+    except SharedTableBusy:
+        raise HTTPException(status_code=503, detail="Metrics are temporarily unavailable", headers={"Retry-After": "1"})
+    return {
+        "worker_pid": os.getpid(),
+        "shared": services.shared_table is not None,
+        **snapshot,
+    }
 
 # Import chat router after defining api_router
 from chat_routes import chat_router
+from rate_limiter import RateLimitMiddleware
 
 # Include chat router
 api_router.include_router(chat_router)
 
+# Include admin router (disabled unless ADMIN_TOKEN is set)
+from admin_routes import admin_router
+api_router.include_router(admin_router)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -54,14 +99,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("AI Coder Backend starting up...")
-    logger.info(f"Database: {os.environ['DB_NAME']}")
-    logger.info("AI Service initialized with Emergent LLM Key")
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-    logger.info("AI Coder Backend shut down")
\ No newline at end of file
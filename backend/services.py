@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ai_service import AIService
+from search_index import SearchIndex, create_search_index
+from session_purger import SessionPurger
+from idempotency import IdempotencyStore
+from lifecycle import LifecycleManager
+from health_monitor import HealthMonitor
+from rate_limiter import RateLimiter, create_rate_limiter
+from shared_state import SharedTable, ModelLatencyStats, STATS_SLOTS, get_shared_table, get_stats_table
+
+logger = logging.getLogger(__name__)
+
+
+class Services:
+    """Per-worker application services, created in the app lifespan rather than at import"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        # Cross-worker table when forked by serve.py, otherwise a private one
+        self.shared_table = get_shared_table()
+        self.stats_table = get_stats_table() or SharedTable(slots=STATS_SLOTS)
+        self.model_stats = ModelLatencyStats(self.stats_table)
+        self.ai_service = AIService(stats=self.model_stats)
+        # Full-text search over chat history (backend selected by SEARCH_BACKEND)
+        self.search_index: SearchIndex = create_search_index(db)
+        # Background purger for deleted sessions
+        self.session_purger = SessionPurger(db, on_purged=self.search_index.remove_session)
+        # Shared store of Idempotency-Key results so client retries reuse the original response
+        self.idempotency_store = IdempotencyStore(db)
+        # Tracks in-flight generations so shutdown can drain them
+        self.lifecycle_manager = LifecycleManager()
+        # Background health probes of the database and LLM providers, taking turns across workers
+        self.health_monitor = HealthMonitor(db, self.ai_service, self.stats_table)
+        # Token-bucket limits for chat requests, per client/session and category
+        self.rate_limiter: RateLimiter = create_rate_limiter(
+            db, self.ai_service.resolve_category, self.shared_table
+        )
+        self._prepare_task: Optional[asyncio.Task] = None
+
+    async def _prepare(self):
+        """Create indexes and load the search index without delaying the first request"""
+        # Keyed requests wait for the idempotency indexes, so create them first
+        for name, prepare in [
+            ("idempotency store", self.idempotency_store.prepare),
+            ("search index", self.search_index.prepare),
+            ("session purger", self.session_purger.prepare),
+            ("rate limiter", self.rate_limiter.prepare),
+        ]:
+            try:
+                await prepare()
+            except Exception as e:
+                logger.error(f"Error preparing {name}: {str(e)}")
+
+    async def start(self):
+        if not self.ai_service.api_key:
+            logger.warning("EMERGENT_LLM_KEY is not set; chat requests will get fallback responses")
+        self._prepare_task = asyncio.create_task(self._prepare())
+        self.session_purger.start()
+        self.health_monitor.start()
+
+    async def stop(self):
+        # Drain in-flight generations before closing the database they write to
+        await self.lifecycle_manager.shutdown()
+        if self._prepare_task:
+            self._prepare_task.cancel()
+            await asyncio.gather(self._prepare_task, return_exceptions=True)
+        await self.session_purger.stop()
+        await self.health_monitor.stop()
+
+
+def get_services(request: Request) -> Services:
+    """Services dependency"""
+    return request.app.state.services
@@ -0,0 +1,192 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Query matching sessions that are still visible (not tombstoned)
+ACTIVE_SESSION_FILTER = {"deleted_at": None}
+# Query matching tombstoned sessions waiting for their messages to be purged
+TOMBSTONED_SESSION_FILTER = {"deleted_at": {"$ne": None}}
+
+
+class SessionPurger:
+    """Background task that removes messages of tombstoned sessions in bounded batches.
+
+    Every worker runs one. Each session is claimed by a single worker through a
+    lease on the session document, which also records the purge progress, so
+    workers do not repeat each other's work and the status is the same
+    whichever worker reports it.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, on_purged: Optional[Callable[[str], None]] = None):
+        self.db = db
+        self.on_purged = on_purged
+        self.batch_size = int(os.environ.get('PURGE_BATCH_SIZE', '500'))
+        self.batch_pause = float(os.environ.get('PURGE_BATCH_PAUSE', '0.05'))
+        self.idle_interval = float(os.environ.get('PURGE_INTERVAL', '30'))
+        # A claim not renewed for this long is assumed to belong to a dead worker
+        self.lease = timedelta(seconds=float(os.environ.get('PURGE_LEASE', '60')))
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def prepare(self):
+        # Batches select a session's messages; history reads them in timestamp order
+        await self.db.chat_messages.create_index([("session_id", 1), ("timestamp", 1)])
+        # Tombstoned sessions are claimed oldest deletion first
+        await self.db.chat_sessions.create_index("deleted_at")
+
+    def start(self):
+        """Start the purge loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the purge loop; unfinished sessions are resumed on next start"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Ask the purge loop to run now instead of waiting for the next interval"""
+        self._wakeup.set()
+
+    async def tombstone(self, query: Dict[str, Any]) -> int:
+        """Hide matching sessions immediately and schedule their messages for purging"""
+        result = await self.db.chat_sessions.update_many(
+            {**query, **ACTIVE_SESSION_FILTER},
+            {"$set": {"deleted_at": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            self.wake()
+        return result.modified_count
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error purging deleted sessions: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def claim_next(self) -> Optional[str]:
+        """Claim the oldest tombstoned session no other worker is purging; returns its id"""
+        now = datetime.utcnow()
+        session = await self.db.chat_sessions.find_one_and_update(
+            {
+                **TOMBSTONED_SESSION_FILTER,
+                "$or": [
+                    {"purge_owner": None},
+                    {"purge_owner": self.owner_id},
+                    {"purge_lease_until": {"$lt": now}},
+                ],
+            },
+            {"$set": {"purge_owner": self.owner_id, "purge_lease_until": now + self.lease}},
+            projection={"id": 1},
+            sort=[("deleted_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return session["id"] if session else None
+
+    async def purge_pending(self):
+        """Purge tombstoned sessions, oldest deletion first, until none is left to claim"""
+        while True:
+            session_id = await self.claim_next()
+            if session_id is None:
+                break
+            await self.purge_session(session_id)
+        await self.db.purge_stats.update_one(
+            {"_id": "totals"}, {"$set": {"last_run_at": datetime.utcnow()}}, upsert=True
+        )
+
+    async def purge_session(self, session_id: str) -> bool:
+        """Delete a claimed session's messages batch by batch, then the session itself.
+
+        Returns False if the claim was lost to another worker midway.
+        """
+        claim = {"id": session_id, "purge_owner": self.owner_id}
+        while True:
+            batch = await self.db.chat_messages.find(
+                {"session_id": session_id}, {"_id": 1}
+            ).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+
+            result = await self.db.chat_messages.delete_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}}
+            )
+            await self.db.purge_stats.update_one(
+                {"_id": "totals"}, {"$inc": {"messages_purged": result.deleted_count}}, upsert=True
+            )
+            # Record progress and renew the lease in one write
+            renewed = await self.db.chat_sessions.update_one(claim, {
+                "$inc": {"messages_purged": result.deleted_count},
+                "$set": {"purge_lease_until": datetime.utcnow() + self.lease},
+            })
+            if not renewed.matched_count:
+                logger.warning(f"Lost purge claim on session {session_id}")
+                return False
+
+            # Yield between batches to avoid saturating the database
+            await asyncio.sleep(self.batch_pause)
+
+        result = await self.db.chat_sessions.delete_one({**claim, **TOMBSTONED_SESSION_FILTER})
+        if not result.deleted_count:
+            return False
+        await self.db.purge_stats.update_one(
+            {"_id": "totals"}, {"$inc": {"sessions_purged": 1}}, upsert=True
+        )
+        if self.on_purged:
+            self.on_purged(session_id)
+        logger.info(f"Purged deleted session {session_id}")
+        return True
+
+    async def get_status(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Report purge progress across all workers, optionally for a single session"""
+        now = datetime.utcnow()
+        totals = await self.db.purge_stats.find_one({"_id": "totals"}) or {}
+        purging = await self.db.chat_sessions.find(
+            {**TOMBSTONED_SESSION_FILTER, "purge_lease_until": {"$gte": now}}, {"id": 1}
+        ).to_list(length=100)
+        status = {
+            "pending_sessions": await self.db.chat_sessions.count_documents(TOMBSTONED_SESSION_FILTER),
+            "purging_sessions": [session["id"] for session in purging],
+            "sessions_purged": totals.get("sessions_purged", 0),
+            "messages_purged": totals.get("messages_purged", 0),
+            "last_run_at": totals.get("last_run_at"),
+        }
+        if session_id:
+            session = await self.db.chat_sessions.find_one({"id": session_id})
+            if session is None:
+                status["session"] = {"id": session_id, "state": "not_found"}
+            elif session.get("deleted_at") is None:
+                status["session"] = {"id": session_id, "state": "active"}
+            else:
+                status["session"] = {
+                    "id": session_id,
+                    "state": "purging",
+                    "deleted_at": session["deleted_at"],
+                    "messages_purged": session.get("messages_purged", 0),
+                    "messages_remaining": await self.db.chat_messages.count_documents(
+                        {"session_id": session_id}
+                    ),
+                }
+        return status
@@ -0,0 +1,203 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import zlib
+import tempfile
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Slot layout: used flag, key length, key bytes, last-touched time, four float values
+KEY_SIZE = 96
+VALUE_COUNT = 4
+SLOT = struct.Struct(f"<BH{KEY_SIZE}sd{VALUE_COUNT}d")
+MAX_PROBES = 32
+
+Values = Tuple[float, ...]
+
+logger = logging.getLogger(__name__)
+
+
+class SharedTableBusy(Exception):
+    """Raised when the table lock cannot be taken in time"""
+
+
+class ProcessLock:
+    """Lock shared by forked workers: a POSIX record lock on an inherited temp file.
+
+    Unlike a multiprocessing.Lock, the kernel releases it when the holding
+    process dies, so a worker killed mid-update cannot block the others.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        # Record locks are per process, so threads of one worker also need a local lock
+        self._local = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        if not self._local.acquire(timeout=timeout):
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.lockf(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self._local.release()
+                    return False
+                time.sleep(0.0002)
+
+    def release(self):
+        fcntl.lockf(self.file, fcntl.LOCK_UN)
+        self._local.release()
+
+
+class SharedTable:
+    """Fixed-size hash table of float records in an anonymous mmap.
+
+    Created in the serving process before workers are forked, the mapping and
+    its lock are inherited by every worker, so all of them read and update
+    the same records. Created inside a single worker it works the same way,
+    just without anyone to share with.
+    """
+
+    def __init__(self, slots: int = 65536, lock=None):
+        self.slots = slots
+        self.buffer = mmap.mmap(-1, slots * SLOT.size)
+        self.lock = lock if lock is not None else threading.Lock()
+        # Callers run on the event loop, so never wait long for another worker
+        self.lock_timeout = float(os.environ.get('SHARED_STATE_LOCK_TIMEOUT', '0.05'))
+
+    def _acquire(self):
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            raise SharedTableBusy(f"Shared table lock not acquired within {self.lock_timeout}s")
+
+    def _encode(self, key: str) -> bytes:
+        encoded = key.encode("utf-8")
+        if len(encoded) > KEY_SIZE:
+            # Long keys are replaced by a digest so they still fit a slot
+            encoded = encoded[:KEY_SIZE - 9] + b"#" + format(zlib.crc32(encoded), "08x").encode()
+        return encoded
+
+    def _read(self, index: int):
+        used, length, key, touched, *values = SLOT.unpack_from(self.buffer, index * SLOT.size)
+        return used, key[:length], touched, tuple(values)
+
+    def _find(self, key: bytes) -> Tuple[int, bool]:
+        """Slot index for a key and whether it already holds it; evicts the stalest probed slot if full"""
+        start = zlib.crc32(key) % self.slots
+        stalest, stalest_touched = start, float("inf")
+        for probe in range(min(MAX_PROBES, self.slots)):
+            index = (start + probe) % self.slots
+            used, slot_key, touched, _ = self._read(index)
+            if not used:
+                return index, False
+            if slot_key == key:
+                return index, True
+            if touched < stalest_touched:
+                stalest, stalest_touched = index, touched
+        return stalest, False
+
+    def get(self, key: str) -> Optional[Values]:
+        """Values of a record, or None; raises SharedTableBusy if the lock is held too long"""
+        encoded = self._encode(key)
+        self._acquire()
+        try:
+            index, found = self._find(encoded)
+            return self._read(index)[3] if found else None
+        finally:
+            self.lock.release()
+
+    def update(self, key: str, update: Callable[[Optional[Values]], Values]) -> Values:
+        """Atomically replace a record with update(old_values); old_values is None for a new key"""
+        encoded = self._encode(key)
+        self._acquire()
+        try:
+            index, found = self._find(encoded)
+            values = tuple(update(self._read(index)[3] if found else None))
+            values = values + (0.0,) * (VALUE_COUNT - len(values))
+            SLOT.pack_into(self.buffer, index * SLOT.size, 1, len(encoded), encoded, time.time(), *values)
+            return values
+        finally:
+            self.lock.release()
+
+    def items(self, prefix: str = "") -> List[Tuple[str, Values]]:
+        """Snapshot of records whose key starts with prefix; scans every slot"""
+        encoded_prefix = prefix.encode("utf-8")
+        # Copy under the lock, parse outside it
+        self._acquire()
+        try:
+            data = self.buffer[:]
+        finally:
+            self.lock.release()
+        return [
+            (key[:length].decode("utf-8", errors="replace"), tuple(values))
+            for used, length, key, _, *values in SLOT.iter_unpack(data)
+            if used and key[:length].startswith(encoded_prefix)
+        ]
+
+
+# Tables created by the serving process before forking workers (see serve.py):
+# a large one for rate-limit buckets and a small one for stats, so reading
+# the stats does not scan the buckets
+_shared_table: Optional[SharedTable] = None
+_stats_table: Optional[SharedTable] = None
+
+STATS_SLOTS = 1024
+
+
+def create_shared_table(slots: int = 65536) -> SharedTable:
+    """Create the cross-worker tables; must be called before workers are forked"""
+    global _shared_table, _stats_table
+    _shared_table = SharedTable(slots, lock=ProcessLock())
+    _stats_table = SharedTable(STATS_SLOTS, lock=ProcessLock())
+    return _shared_table
+
+
+def get_shared_table() -> Optional[SharedTable]:
+    return _shared_table
+
+
+def get_stats_table() -> Optional[SharedTable]:
+    return _stats_table
+
+
+class ModelLatencyStats:
+    """Per-model generation latency and per-worker counts, aggregated across workers"""
+
+    def __init__(self, table: SharedTable):
+        self.table = table
+
+    def record(self, model: str, latency_ms: float, failed: bool = False):
+        def add(values: Optional[Values]) -> Values:
+            count, total_ms, max_ms, errors = values or (0.0, 0.0, 0.0, 0.0)
+            return count + 1, total_ms + latency_ms, max(max_ms, latency_ms), errors + (1 if failed else 0)
+
+        try:
+            self.table.update(f"latency:{model}", add)
+            self.table.update(f"worker:{os.getpid()}", add)
+        except SharedTableBusy as e:
+            # Stats are best effort; never hold up a generation for them
+            logger.warning(f"Dropping latency sample for {model}: {str(e)}")
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        def summarize(values: Values) -> Dict[str, float]:
+            count, total_ms, max_ms, errors = values
+            return {
+                "count": int(count),
+                "mean_ms": round(total_ms / count, 1) if count else 0.0,
+                "max_ms": round(max_ms, 1),
+                "errors": int(errors),
+            }
+
+        snapshot: Dict[str, Dict[str, Dict[str, float]]] = {"models": {}, "workers": {}}
+        for key, values in self.table.items():
+            kind, name = key.split(":", 1)
+            if kind == "latency":
+                snapshot["models"][name] = summarize(values)
+            elif kind == "worker":
+                snapshot["workers"][name] = summarize(values)
+        return snapshot
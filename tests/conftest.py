@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# Backend modules are flat and import each other by name, as when run from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["ai_coder_test"]
+
+
+@pytest.fixture
+def make_app(db, monkeypatch):
+    """FastAPI app with the chat routes and a Services container on the mock database"""
+    monkeypatch.setenv("HEALTH_PROBE_MODE", "stub")
+
+    def make(**overrides):
+        from fastapi import FastAPI
+
+        from chat_routes import chat_router
+        from database import get_database
+        from services import Services
+
+        app = FastAPI()
+        app.include_router(chat_router, prefix="/api")
+        services = Services(db)
+        for name, value in overrides.items():
+            setattr(services, name, value)
+        app.state.services = services
+        app.dependency_overrides[get_database] = lambda: db
+        return app
+
+    return make
@@ -0,0 +1,42 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from admin_routes import admin_router
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(admin_router, prefix="/api")
+    return app
+
+
+def get_slow_requests(app, headers):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            return await client.get("/api/admin/slow-requests", headers=headers)
+
+    return asyncio.run(scenario()).status_code
+
+
+def test_matching_token_is_allowed(app):
+    assert get_slow_requests(app, {"X-Admin-Token": "secret"}) == 200
+
+
+@pytest.mark.parametrize("token", [b"wrong", "секрет".encode(), b"\xff\xfe"])
+def test_other_tokens_are_forbidden(app, token):
+    assert get_slow_requests(app, {"X-Admin-Token": token}) == 403
+
+
+def test_missing_token_is_forbidden(app):
+    assert get_slow_requests(app, {}) == 403
+
+
+def test_admin_api_is_hidden_without_configured_token(app, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN")
+    assert get_slow_requests(app, {"X-Admin-Token": "secret"}) == 404
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ai_service import AIService
+from health_monitor import HealthMonitor
+from shared_state import SharedTable
+
+
+class FakeAIService:
+    api_key = "key"
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.probes = []
+        self.sdk_loads = 0
+
+    async def load_sdk(self):
+        self.sdk_loads += 1
+
+    def get_configured_models(self):
+        return [("openai", "gpt"), ("anthropic", "claude")]
+
+    async def probe_model(self, provider, model):
+        self.probes.append(f"{provider}/{model}")
+        if provider in self.failing:
+            raise RuntimeError("provider down")
+
+
+class FakeDatabase:
+    async def command(self, name):
+        return {"ok": 1}
+
+
+@pytest.fixture(autouse=True)
+def live_probes(monkeypatch):
+    monkeypatch.setenv("HEALTH_PROBE_MODE", "live")
+    monkeypatch.setenv("HEALTH_DB_INTERVAL", "0.01")
+    monkeypatch.setenv("HEALTH_PROVIDER_INTERVAL", "60")
+
+
+def monitor(ai_service, table):
+    return HealthMonitor(FakeDatabase(), ai_service, table)
+
+
+def test_sdk_is_loaded_in_a_worker_thread(monkeypatch):
+    monkeypatch.setenv("EMERGENT_LLM_KEY", "key")
+    ai_service = AIService()
+    threads = []
+
+    def get_sdk():
+        threads.append(threading.current_thread())
+        ai_service._sdk = SimpleNamespace()
+        return ai_service._sdk
+
+    monkeypatch.setattr(ai_service, "_get_sdk", get_sdk)
+    sdk = asyncio.run(ai_service.load_sdk())
+    assert sdk is ai_service._sdk
+    assert threads and threads[0] is not threading.main_thread()
+    # Already loaded: no second import
+    asyncio.run(ai_service.load_sdk())
+    assert len(threads) == 1
+
+
+def test_fresh_worker_probes_without_waiting_for_a_chat():
+    ai_service = FakeAIService(failing={"anthropic"})
+    health = monitor(ai_service, SharedTable(slots=64))
+
+    async def scenario():
+        health.start()
+        await asyncio.sleep(0.05)
+        await health.stop()
+
+    asyncio.run(scenario())
+    assert ai_service.sdk_loads == 1
+    assert sorted(ai_service.probes) == ["anthropic/claude", "openai/gpt"]
+    assert health.summary()["ai_service"] == "degraded"
+    assert health.checks["anthropic/claude"]["error"] == "provider down"
+
+
+def test_workers_sharing_a_table_probe_once_and_share_results():
+    table = SharedTable(slots=64)
+    first, second = FakeAIService(failing={"anthropic"}), FakeAIService()
+    workers = [monitor(first, table), monitor(second, table)]
+
+    async def scenario():
+        for worker in workers:
+            worker.start()
+        await asyncio.sleep(0.05)
+        for worker in workers:
+            await worker.stop()
+
+    asyncio.run(scenario())
+    assert len(first.probes) + len(second.probes) == 2
+    prober, reader = workers if first.probes else reversed(workers)
+    assert reader.checks["openai/gpt"]["checked_at"] == prober.checks["openai/gpt"]["checked_at"]
+    assert reader.summary()["ai_service"] == prober.summary()["ai_service"]
+    assert reader.checks["anthropic/claude"]["status"] == prober.checks["anthropic/claude"]["status"]
+
+
+def test_next_round_is_claimed_after_the_interval():
+    table = SharedTable(slots=64)
+    health = monitor(FakeAIService(), table)
+    assert health._claim_provider_round()
+    assert not health._claim_provider_round()
+
+    # The round expires, e.g. because the worker that claimed it died
+    table.update("health:round", lambda values: (0.0, values[1]))
+    assert health._claim_provider_round()
@@ -0,0 +1,190 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from idempotency import IdempotencyConflict, IdempotencyStore, request_fingerprint
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for IdempotencyStore"""
+
+    def __init__(self, fail_indexes: int = 0):
+        self.documents = []
+        self.unique_key = False
+        self.fail_indexes = fail_indexes
+        self.index_calls = 0
+
+    @staticmethod
+    def _matches(document, query):
+        return all(document.get(field) == value for field, value in query.items())
+
+    async def create_index(self, field, **options):
+        self.index_calls += 1
+        if self.fail_indexes:
+            self.fail_indexes -= 1
+            raise RuntimeError("index build failed")
+        if field == "key" and options.get("unique"):
+            self.unique_key = True
+
+    async def insert_one(self, document):
+        if self.unique_key and any(existing["key"] == document["key"] for existing in self.documents):
+            raise DuplicateKeyError("duplicate key")
+        self.documents.append(dict(document))
+
+    async def find_one(self, query):
+        return next((dict(document) for document in self.documents if self._matches(document, query)), None)
+
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if self._matches(document, query):
+                document.update(update["$set"])
+                return SimpleNamespace(modified_count=1)
+        return SimpleNamespace(modified_count=0)
+
+    async def delete_one(self, query):
+        for document in self.documents:
+            if self._matches(document, query):
+                self.documents.remove(document)
+                return
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+@pytest.fixture
+def store(collection, monkeypatch):
+    monkeypatch.setenv("IDEMPOTENCY_WAIT_TIMEOUT", "0.05")
+    monkeypatch.setenv("IDEMPOTENCY_POLL_INTERVAL", "0.01")
+    monkeypatch.setenv("IDEMPOTENCY_LOCK_TIMEOUT", "120")
+    return IdempotencyStore(SimpleNamespace(idempotency_keys=collection))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fingerprint_depends_on_every_part():
+    assert request_fingerprint("hi", "code", None) == request_fingerprint("hi", "code", "")
+    assert request_fingerprint("hi", "code", None) != request_fingerprint("hi", "text", None)
+    # Parts are delimited, so shifting text between them changes the hash
+    assert request_fingerprint("ab", "c") != request_fingerprint("a", "bc")
+
+
+def test_first_request_claims_the_key(store, collection):
+    assert run(store.begin("k", "f", "a")) is None
+    assert collection.documents[0]["status"] == "in_progress"
+    assert collection.unique_key
+
+
+def test_completed_key_returns_stored_response(store):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        await store.complete("k", "a", {"response": "done"})
+        return await store.begin("k", "f", "a")
+
+    assert run(scenario()) == {"response": "done"}
+
+
+def test_reused_key_with_other_request_is_rejected(store):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        await store.complete("k", "a", {"response": "done"})
+        await store.begin("k", "other", "a")
+
+    with pytest.raises(IdempotencyConflict) as conflict:
+        run(scenario())
+    assert conflict.value.status_code == 422
+
+
+def test_retry_waits_for_in_progress_request(store):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        retry = asyncio.create_task(store.begin("k", "f", "b"))
+        await asyncio.sleep(0.02)
+        assert not retry.done()
+        await store.complete("k", "a", {"response": "done"})
+        return await retry
+
+    assert run(scenario()) == {"response": "done"}
+
+
+def test_retry_gives_up_while_still_in_progress(store):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        await store.begin("k", "f", "a")
+
+    with pytest.raises(IdempotencyConflict) as conflict:
+        run(scenario())
+    assert conflict.value.status_code == 409
+
+
+def test_abandoned_key_can_be_claimed_again(store, collection):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        await store.abandon("k", "a")
+        return await store.begin("k", "f", "a")
+
+    assert run(scenario()) is None
+    assert len(collection.documents) == 1
+
+
+def test_stale_lock_is_taken_over(store, collection):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        # The worker that claimed the key died long ago
+        collection.documents[0]["locked_at"] = datetime.utcnow() - timedelta(minutes=10)
+        return await store.begin("k", "f", "b")
+
+    assert run(scenario()) is None
+    assert collection.documents[0]["locked_at"] > datetime.utcnow() - timedelta(minutes=1)
+    assert collection.documents[0]["owner"] == "b"
+
+
+def test_taken_over_owner_cannot_complete_or_abandon(store, collection):
+    async def scenario():
+        await store.begin("k", "f", "a")
+        collection.documents[0]["locked_at"] = datetime.utcnow() - timedelta(minutes=10)
+        await store.begin("k", "f", "b")
+        # The original request finishes late and must not touch the new claim
+        await store.complete("k", "a", {"response": "late"})
+        await store.abandon("k", "a")
+
+    run(scenario())
+    assert collection.documents[0]["status"] == "in_progress"
+    assert collection.documents[0]["owner"] == "b"
+
+
+def test_keep_alive_prevents_takeover(store, collection, monkeypatch):
+    monkeypatch.setenv("IDEMPOTENCY_LOCK_TIMEOUT", "0.03")
+    store = IdempotencyStore(SimpleNamespace(idempotency_keys=collection))
+
+    async def scenario():
+        await store.begin("k", "f", "a")
+        keep_alive = asyncio.create_task(store.keep_alive("k", "a"))
+        await asyncio.sleep(0.1)
+        # Still well inside the lock timeout despite the request running longer
+        retry = await asyncio.gather(store.begin("k", "f", "b"), return_exceptions=True)
+        keep_alive.cancel()
+        return retry[0]
+
+    assert isinstance(run(scenario()), IdempotencyConflict)
+    assert collection.documents[0]["owner"] == "a"
+
+
+def test_keys_are_refused_until_indexes_exist():
+    collection = FakeCollection(fail_indexes=1)
+    store = IdempotencyStore(SimpleNamespace(idempotency_keys=collection))
+
+    with pytest.raises(IdempotencyConflict) as conflict:
+        run(store.begin("k", "f", "a"))
+    assert conflict.value.status_code == 503
+    assert collection.documents == []
+
+    # The next request retries index creation and then proceeds
+    assert run(store.begin("k", "f", "a")) is None
+    assert collection.unique_key
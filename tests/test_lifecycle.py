@@ -0,0 +1,51 @@
+import asyncio
+import os
+import signal
+
+from lifecycle import LifecycleManager, ServiceShuttingDown
+
+
+def test_exit_signal_stops_accepting_before_the_server_handler_runs():
+    manager = LifecycleManager()
+    seen = []
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        # Stands in for uvicorn's handler, registered before the lifespan starts
+        loop.add_signal_handler(signal.SIGTERM, lambda: seen.append(manager.accepting))
+        try:
+            manager.install_exit_handlers()
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(0.05)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+
+    asyncio.run(scenario())
+    assert seen == [False]
+    assert not manager.accepting
+
+
+def test_generations_are_refused_after_stop_accepting():
+    manager = LifecycleManager()
+
+    async def scenario():
+        manager.stop_accepting()
+        coro = asyncio.sleep(0)
+        try:
+            manager.run_generation(coro)
+        except ServiceShuttingDown:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+
+
+def test_without_server_handlers_nothing_is_installed():
+    manager = LifecycleManager()
+
+    async def scenario():
+        manager.install_exit_handlers()
+        return getattr(asyncio.get_running_loop(), "_signal_handlers", {})
+
+    assert not asyncio.run(scenario())
+    assert manager.accepting
@@ -0,0 +1,231 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import rate_limiter
+from rate_limiter import Budget, InMemoryBucketStore, RateLimiter, RateLimitMiddleware, SharedBucketStore
+from shared_state import SharedTable
+
+
+class Clock:
+    """Manually advanced replacement for time.monotonic/time.time"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class BusyLock:
+    """Lock another worker never releases"""
+
+    def acquire(self, timeout=None) -> bool:
+        return False
+
+    def release(self):
+        raise AssertionError("released a lock that was not acquired")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    monkeypatch.setattr(rate_limiter.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "shared"])
+def store(request, clock):
+    if request.param == "memory":
+        return InMemoryBucketStore()
+    return SharedBucketStore(SharedTable(slots=64))
+
+
+def take(store, key: str, budget: Budget) -> float:
+    return asyncio.run(store.take(key, budget))
+
+
+def peek(store, key: str, budget: Budget) -> float:
+    return asyncio.run(store.peek(key, budget))
+
+
+def test_budget_parse():
+    budget = Budget.parse("20/60")
+    assert budget.capacity == 20
+    assert budget.refill_rate == pytest.approx(1 / 3)
+
+
+def test_bucket_allows_burst_then_rejects(store):
+    budget = Budget.parse("3/60")
+    assert [take(store, "k", budget) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # One token refills every 20 seconds
+    assert take(store, "k", budget) == pytest.approx(20.0)
+
+
+def test_bucket_refills_over_time(store, clock):
+    budget = Budget.parse("2/60")
+    take(store, "k", budget)
+    take(store, "k", budget)
+    assert take(store, "k", budget) > 0
+
+    clock.now += 15
+    assert take(store, "k", budget) == pytest.approx(15.0)
+    clock.now += 15
+    assert take(store, "k", budget) == 0.0
+
+
+def test_bucket_never_exceeds_capacity(store, clock):
+    budget = Budget.parse("2/60")
+    take(store, "k", budget)
+    clock.now += 3600
+    assert [take(store, "k", budget) for _ in range(3)][-1] > 0
+
+
+def test_rejected_take_does_not_consume(store, clock):
+    budget = Budget.parse("1/60")
+    take(store, "k", budget)
+    for _ in range(5):
+        take(store, "k", budget)
+    clock.now += 60
+    assert take(store, "k", budget) == 0.0
+
+
+def test_peek_does_not_consume(store):
+    budget = Budget.parse("1/60")
+    assert peek(store, "k", budget) == 0.0
+    assert peek(store, "k", budget) == 0.0
+    assert take(store, "k", budget) == 0.0
+    assert peek(store, "k", budget) == pytest.approx(60.0)
+
+
+def test_buckets_are_independent(store):
+    budget = Budget.parse("1/60")
+    assert take(store, "a", budget) == 0.0
+    assert take(store, "b", budget) == 0.0
+    assert take(store, "a", budget) > 0
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    store = InMemoryBucketStore(max_keys=2)
+    budget = Budget.parse("1/60")
+    take(store, "a", budget)
+    take(store, "b", budget)
+    take(store, "a", budget)
+    take(store, "c", budget)
+    assert list(store.buckets) == ["a", "c"]
+
+
+def test_shared_store_fails_open_when_table_is_busy(clock):
+    table = SharedTable(slots=64, lock=BusyLock())
+    table.lock_timeout = 0
+    store = SharedBucketStore(table)
+    budget = Budget.parse("1/60")
+    assert [take(store, "k", budget) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert peek(store, "k", budget) == 0.0
+
+
+def make_limiter(monkeypatch, budget: str = "1/60", **env) -> RateLimiter:
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return RateLimiter(InMemoryBucketStore(), {"text": Budget.parse(budget)}, lambda message, category: "text")
+
+
+def test_client_key_ignores_forwarded_for_by_default(monkeypatch):
+    limiter = make_limiter(monkeypatch)
+    headers = Headers({"x-forwarded-for": "9.9.9.9"})
+    assert limiter.client_key({"client": ("1.2.3.4", 5000)}, headers) == "ip:1.2.3.4"
+
+
+def test_client_key_uses_hop_added_by_trusted_proxies(monkeypatch):
+    limiter = make_limiter(monkeypatch, RATE_LIMIT_TRUST_PROXY="true", RATE_LIMIT_PROXY_HOPS="2")
+    scope = {"client": ("10.0.0.1", 5000)}
+    # The client wrote "forged"; the two proxies appended 1.1.1.1 and 10.0.0.2
+    headers = Headers({"x-forwarded-for": "forged, 1.1.1.1, 10.0.0.2"})
+    assert limiter.client_key(scope, headers) == "ip:1.1.1.1"
+    assert limiter.client_key(scope, Headers({"x-forwarded-for": "1.1.1.1"})) == "ip:1.1.1.1"
+
+
+def test_only_known_api_keys_select_the_bucket(monkeypatch):
+    limiter = make_limiter(monkeypatch, RATE_LIMIT_API_KEYS="good, other")
+    scope = {"client": ("1.2.3.4", 5000)}
+    assert limiter.client_key(scope, Headers({"x-api-key": "good"})) == "key:good"
+    assert limiter.client_key(scope, Headers({"x-api-key": "made-up"})) == "ip:1.2.3.4"
+
+
+def test_rotating_spoofable_headers_does_not_reset_the_limit(monkeypatch, clock):
+    limiter = make_limiter(monkeypatch)
+    scope = {"client": ("1.2.3.4", 5000)}
+    results = [
+        asyncio.run(limiter.check(scope, Headers({"x-forwarded-for": f"9.9.9.{i}", "x-api-key": f"k{i}"}), {"message": "hi"}))
+        for i in range(3)
+    ]
+    assert results[0] is None
+    assert [result[0] for result in results[1:]] == ["client", "client"]
+
+
+def test_session_rejection_does_not_charge_client(monkeypatch, clock):
+    limiter = make_limiter(monkeypatch)
+    headers = Headers({})
+    assert asyncio.run(limiter.check({"client": ("8.8.8.8", 1)}, headers, {"message": "hi", "session_id": "s"})) is None
+
+    rejected = asyncio.run(limiter.check({"client": ("8.8.4.4", 1)}, headers, {"message": "hi", "session_id": "s"}))
+    assert rejected[0] == "session"
+    # The second client was not charged for the rejected request
+    assert asyncio.run(limiter.check({"client": ("8.8.4.4", 1)}, headers, {"message": "hi", "session_id": "t"})) is None
+
+
+def test_private_peer_without_trusted_proxy_gets_no_client_bucket(monkeypatch):
+    limiter = make_limiter(monkeypatch)
+    for peer in ("10.0.0.5", "127.0.0.1", "not-an-ip"):
+        assert limiter.client_key({"client": (peer, 5000)}, Headers({"x-forwarded-for": "1.1.1.1"})) is None
+    # A verified API key still identifies the caller behind the proxy
+    limiter.api_keys = frozenset({"good"})
+    assert limiter.client_key({"client": ("10.0.0.5", 5000)}, Headers({"x-api-key": "good"})) == "key:good"
+
+
+def post_through_proxy(app, forwarded_for: str, payload: dict) -> int:
+    async def send():
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.5", 5000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            response = await client.post("/api/chat/", json=payload, headers={"x-forwarded-for": forwarded_for})
+            return response.status_code
+
+    return asyncio.run(send())
+
+
+def make_app(limiter: RateLimiter):
+    async def chat(request):
+        return JSONResponse({"ok": True})
+
+    app = Starlette(
+        routes=[Route("/api/chat/", chat, methods=["POST"])],
+        middleware=[Middleware(RateLimitMiddleware)]
+    )
+    app.state.services = SimpleNamespace(rate_limiter=limiter)
+    return app
+
+
+def test_users_behind_untrusted_proxy_do_not_share_a_bucket(monkeypatch, clock):
+    app = make_app(make_limiter(monkeypatch))
+    # Many users behind the ingress, each in their own session
+    assert [post_through_proxy(app, f"1.1.1.{i}", {"message": "hi", "session_id": f"s{i}"}) for i in range(5)] == [200] * 5
+    # Sessions are still limited
+    assert post_through_proxy(app, "1.1.1.0", {"message": "hi", "session_id": "s0"}) == 429
+
+
+def test_users_behind_trusted_proxy_are_limited_per_client(monkeypatch, clock):
+    app = make_app(make_limiter(monkeypatch, RATE_LIMIT_TRUST_PROXY="true"))
+    assert post_through_proxy(app, "1.1.1.1", {"message": "hi"}) == 200
+    assert post_through_proxy(app, "1.1.1.2", {"message": "hi"}) == 200
+    assert post_through_proxy(app, "1.1.1.1", {"message": "hi"}) == 429
+    # The client cannot escape by prepending a forged hop
+    assert post_through_proxy(app, "6.6.6.6, 1.1.1.2", {"message": "hi"}) == 429
@@ -0,0 +1,178 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+
+from models import ChatMessage
+from search_index import InMemorySearchIndex, MongoTextSearchIndex, make_snippet, stem, tokenize
+
+
+def message(content: str, session_id: str = "s1", category: str = "text", **fields) -> ChatMessage:
+    return ChatMessage(session_id=session_id, type="user", content=content, category=category, **fields)
+
+
+def search(index: InMemorySearchIndex, query: str, **filters):
+    return asyncio.run(index.search(query, **filters))
+
+
+@pytest.mark.parametrize("forms", [
+    ["сортировка", "сортировки", "сортировку"],
+    ["массивы", "массива"],
+    ["sorting", "sorted", "sorts"],
+])
+def test_stem_maps_inflections_to_one_term(forms):
+    assert len({stem(form) for form in forms}) == 1
+
+
+def test_stem_keeps_short_words():
+    assert stem("кот") == "кот"
+    assert stem("is") == "is"
+
+
+def test_tokenize_lowercases_drops_stop_words_and_folds_yo():
+    assert tokenize("Как отсортировать Массив в Python? Это ёлка") == ["отсортирова", "массив", "python", "елк"]
+
+
+def test_tokenize_empty_and_punctuation():
+    assert tokenize("") == []
+    assert tokenize("?!, ...") == []
+
+
+def test_make_snippet_centres_on_first_match():
+    content = "начало " * 40 + "искомое слово" + " конец" * 40
+    snippet = make_snippet(content, ["искомое"], length=60)
+    assert "искомое" in snippet
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert make_snippet("short text", ["missing"]) == "short text"
+
+
+def test_search_matches_other_word_forms():
+    index = InMemorySearchIndex()
+    index.add(message("Напиши сортировку массива на Python"))
+    index.add(message("Расскажи про деревья"))
+
+    results = search(index, "сортировка массивов")
+    assert [result.message.content for result in results] == ["Напиши сортировку массива на Python"]
+    assert "сортировку" in results[0].snippet
+
+
+def test_bm25_ranks_rarer_terms_and_shorter_documents_higher():
+    index = InMemorySearchIndex()
+    short = message("python декоратор")
+    long = message("python декоратор " + "и ещё много других слов про разное " * 5)
+    common = message("python python python")
+    for item in (short, long, common):
+        index.add(item)
+
+    ranked = [result.message.id for result in search(index, "python декоратор")]
+    assert ranked[0] == short.id
+    assert ranked.index(long.id) < ranked.index(common.id)
+    scores = [result.score for result in search(index, "python декоратор")]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_filters():
+    index = InMemorySearchIndex()
+    old = message("старый код", session_id="a", category="code", timestamp=datetime(2020, 1, 1))
+    new = message("новый код", session_id="b", category="analysis", timestamp=datetime(2024, 1, 1))
+    index.add(old)
+    index.add(new)
+
+    def ids(**filters):
+        return {result.message.id for result in search(index, "код", **filters)}
+
+    assert ids() == {old.id, new.id}
+    assert ids(category="code") == {old.id}
+    assert ids(session_id="b") == {new.id}
+    assert ids(since=datetime(2023, 1, 1)) == {new.id}
+    assert ids(until=datetime(2023, 1, 1)) == {old.id}
+    assert ids(session_id="missing") == set()
+
+
+def test_search_respects_limit():
+    index = InMemorySearchIndex()
+    for i in range(10):
+        index.add(message(f"ошибка номер {i}"))
+    assert len(search(index, "ошибка", limit=3)) == 3
+
+
+def test_remove_session_forgets_messages_and_terms():
+    index = InMemorySearchIndex()
+    index.add(message("уникальное слово", session_id="gone"))
+    kept = message("обычное слово", session_id="kept")
+    index.add(kept)
+
+    index.remove_session("gone")
+    assert [result.message.id for result in search(index, "слово")] == [kept.id]
+    assert search(index, "уникальное") == []
+    assert "уникальн" not in index.postings
+    assert index.total_length == len(tokenize(kept.content))
+
+
+def test_add_is_idempotent():
+    index = InMemorySearchIndex()
+    item = message("повтор")
+    index.add(item)
+    index.add(item)
+    assert len(index.documents) == 1
+    assert index.postings["повтор"] == {item.id: 1}
+
+
+def test_unmatched_or_empty_query_returns_nothing():
+    index = InMemorySearchIndex()
+    assert search(index, "что угодно") == []
+    index.add(message("текст"))
+    assert search(index, "и в на") == []
+    assert search(index, "отсутствует") == []
+
+
+def test_common_terms_only_score_capped_candidates_newest_first():
+    index = InMemorySearchIndex()
+    index.max_candidates = 3
+    rare = message("ошибка сервера")
+    index.add(rare)
+    for i in range(10):
+        index.add(message(f"ошибка номер {i}"))
+
+    # The rare term seeds the candidates, the common one fills the rest with the newest hits
+    results = search(index, "ошибка сервера", limit=10)
+    assert len(results) == 3
+    assert results[0].message.id == rare.id
+    assert {result.message.content for result in results[1:]} == {"ошибка номер 9", "ошибка номер 8"}
+
+
+def test_capped_candidates_respect_filters():
+    index = InMemorySearchIndex()
+    index.max_candidates = 2
+    wanted = message("ошибка в коде", category="code")
+    index.add(wanted)
+    for i in range(10):
+        index.add(message(f"ошибка номер {i}"))
+
+    assert [result.message.id for result in search(index, "ошибка", category="code")] == [wanted.id]
+
+
+def test_mongo_index_stores_tokenized_terms_and_backfills(db):
+    async def scenario():
+        await db.chat_messages.insert_one(message("Сортировки массивов").dict())
+        await db.chat_messages.create_index([("content", "text")], name="content_text", default_language="russian")
+        index = MongoTextSearchIndex(db)
+        await index.prepare()
+        return index, await db.chat_messages.index_information(), await db.chat_messages.find_one()
+
+    index, indexes, stored = asyncio.run(scenario())
+    assert "content_text" not in indexes
+    assert indexes["search_terms_text"]["key"] == [("search_terms", "text")]
+    assert stored["search_terms"] == "сортировк массив"
+    assert index.document_fields(message("Sorting the arrays")) == {"search_terms": "sort array"}
+
+
+@pytest.mark.parametrize("limit", [0, 101])
+def test_search_route_rejects_out_of_range_limit(make_app, limit):
+    async def scenario():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            return await client.get("/api/chat/search", params={"q": "код", "limit": limit})
+
+    assert asyncio.run(scenario()).status_code == 422
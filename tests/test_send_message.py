@@ -0,0 +1,225 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ai_service import GenerationFailed
+from models import ChatSession
+
+
+class FlakyCollection:
+    """Wraps a collection so chosen methods fail a given number of times"""
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        if self.failures.get(name, 0) == 0:
+            return method
+
+        async def fail(*args, **kwargs):
+            self.failures[name] -= 1
+            raise RuntimeError(f"{name} failed")
+
+        return fail
+
+
+class FlakyDatabase:
+    def __init__(self, db, **failures):
+        self.db = db
+        self.failures = failures
+
+    def __getattr__(self, name):
+        collection = getattr(self.db, name)
+        if name == "chat_messages":
+            return FlakyCollection(collection, self.failures)
+        return collection
+
+
+class FakeProvider:
+    """Records the session label of each generation"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.session_ids = []
+        self.cancelled = 0
+
+    async def generate_response(self, message: str, category: str, session_id: str) -> str:
+        self.session_ids.append(session_id)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise GenerationFailed("fallback")
+        return f"reply to {message}"
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("AI_WRITE_RETRY_DELAY", "0.01")
+    monkeypatch.setenv("IDEMPOTENCY_POLL_INTERVAL", "0.01")
+
+
+def make_chat_app(make_app, db, provider: FakeProvider, database=None):
+    from database import get_database
+
+    app = make_app()
+    app.state.services.ai_service.generate_response = provider.generate_response
+    if database is not None:
+        app.dependency_overrides[get_database] = lambda: database
+    return app
+
+
+async def post(app, payload, headers=None):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+        return await client.post("/api/chat/", json=payload, headers=headers or {})
+
+
+async def flush(app):
+    """Wait for deferred writes the way shutdown does"""
+    await app.state.services.lifecycle_manager.shutdown()
+
+
+async def messages(db, session_id):
+    return [
+        (message["type"], message["content"])
+        for message in await db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1).to_list(10)
+    ]
+
+
+def test_new_session_stores_both_messages_under_the_generation_label(db, make_app):
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider)
+
+    async def scenario():
+        response = await post(app, {"message": "hello"})
+        await flush(app)
+        return response, await messages(db, response.json()["session_id"])
+
+    response, stored = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert provider.session_ids == [response.json()["session_id"]]
+    assert stored == [("user", "hello"), ("ai", "reply to hello")]
+
+
+def test_existing_session_is_reused(db, make_app):
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider)
+
+    async def scenario():
+        await db.chat_sessions.insert_one(ChatSession(id="s1").dict())
+        response = await post(app, {"message": "hello", "session_id": "s1"})
+        await flush(app)
+        return response, await messages(db, "s1")
+
+    response, stored = asyncio.run(scenario())
+    assert response.json()["session_id"] == "s1"
+    assert provider.session_ids == ["s1"]
+    assert len(stored) == 2
+
+
+def test_deleted_session_gets_a_new_session_and_label(db, make_app):
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider)
+
+    async def scenario():
+        await db.chat_sessions.insert_one(ChatSession(id="gone").dict())
+        await app.state.services.session_purger.tombstone({"id": "gone"})
+        response = await post(app, {"message": "hello", "session_id": "gone"})
+        await flush(app)
+        return response, await messages(db, "gone")
+
+    response, stored_in_deleted = asyncio.run(scenario())
+    session_id = response.json()["session_id"]
+    assert session_id != "gone"
+    assert provider.session_ids == [session_id]
+    assert stored_in_deleted == []
+
+
+def test_user_message_failure_cancels_the_generation(db, make_app):
+    provider = FakeProvider(delay=5)
+    app = make_chat_app(make_app, db, provider, database=FlakyDatabase(db, insert_one=1))
+
+    async def scenario():
+        response = await post(app, {"message": "hello"})
+        await asyncio.sleep(0)
+        return response
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 500
+    assert provider.cancelled == 1
+
+
+def test_ai_message_write_is_retried(db, make_app):
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider, database=FlakyDatabase(db, update_one=2))
+
+    async def scenario():
+        response = await post(app, {"message": "hello"})
+        await flush(app)
+        return response, await messages(db, response.json()["session_id"])
+
+    response, stored = asyncio.run(scenario())
+    assert stored == [("user", "hello"), ("ai", "reply to hello")]
+    assert response.json()["id"] == asyncio.run(db.chat_messages.find_one({"type": "ai"}))["id"]
+
+
+def test_idempotent_retry_waits_for_ai_message_write(db, make_app):
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider, database=FlakyDatabase(db, update_one=2))
+    headers = {"Idempotency-Key": "k1"}
+
+    async def scenario():
+        first = await post(app, {"message": "hello"}, headers)
+        retry = await post(app, {"message": "hello"}, headers)
+        await flush(app)
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.json()["response"] == first.json()["response"]
+    assert len(provider.session_ids) == 1
+
+
+def test_key_is_released_when_ai_message_write_gives_up(db, make_app, monkeypatch):
+    monkeypatch.setenv("AI_WRITE_ATTEMPTS", "2")
+    provider = FakeProvider()
+    app = make_chat_app(make_app, db, provider, database=FlakyDatabase(db, update_one=2))
+    headers = {"Idempotency-Key": "k1"}
+
+    async def scenario():
+        first = await post(app, {"message": "hello"}, headers)
+        # Wait for the write to give up and the key to be released
+        for _ in range(100):
+            if await db.idempotency_keys.count_documents({}) == 0:
+                break
+            await asyncio.sleep(0.01)
+        retry = await post(app, {"message": "hello"}, headers)
+        await flush(app)
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert retry.json()["id"] != first.json()["id"]
+    assert len(provider.session_ids) == 2
+
+
+def test_fallback_reply_is_not_stored_for_retries(db, make_app):
+    provider = FakeProvider(fail=True)
+    app = make_chat_app(make_app, db, provider)
+    headers = {"Idempotency-Key": "k1"}
+
+    async def scenario():
+        first = await post(app, {"message": "hello"}, headers)
+        provider.fail = False
+        retry = await post(app, {"message": "hello"}, headers)
+        await flush(app)
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first.json()["response"] == "fallback"
+    assert retry.json()["response"] == "reply to hello"
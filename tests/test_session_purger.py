@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from models import ChatMessage, ChatSession
+from session_purger import SessionPurger
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def add_session(db, session_id: str, messages: int = 0, **fields):
+    session = ChatSession(id=session_id, **fields)
+    await db.chat_sessions.insert_one(session.dict())
+    for i in range(messages):
+        await db.chat_messages.insert_one(
+            ChatMessage(session_id=session_id, type="user", content=f"message {i}", category="text").dict()
+        )
+
+
+@pytest.fixture
+def purger(db, monkeypatch):
+    monkeypatch.setenv("PURGE_BATCH_SIZE", "2")
+    monkeypatch.setenv("PURGE_BATCH_PAUSE", "0")
+    return SessionPurger(db)
+
+
+def test_tombstone_hides_session_once(db, purger):
+    async def scenario():
+        await add_session(db, "s1", messages=3)
+        first = await purger.tombstone({"id": "s1"})
+        second = await purger.tombstone({"id": "s1"})
+        session = await db.chat_sessions.find_one({"id": "s1"})
+        return first, second, session, await db.chat_messages.count_documents({})
+
+    first, second, session, messages = run(scenario())
+    assert (first, second) == (1, 0)
+    assert session["deleted_at"] is not None
+    # Messages stay until the background purge reaches them
+    assert messages == 3
+
+
+def test_purge_removes_messages_in_batches(db, purger):
+    purged = []
+    purger.on_purged = purged.append
+
+    async def scenario():
+        await add_session(db, "gone", messages=5)
+        await add_session(db, "kept", messages=2)
+        await purger.tombstone({"id": "gone"})
+        await purger.purge_pending()
+        return (
+            await db.chat_sessions.find_one({"id": "gone"}),
+            await db.chat_messages.count_documents({"session_id": "kept"}),
+            await purger.get_status(),
+        )
+
+    session, kept_messages, status = run(scenario())
+    assert session is None
+    assert kept_messages == 2
+    assert purged == ["gone"]
+    assert status["pending_sessions"] == 0
+    assert status["sessions_purged"] == 1
+    assert status["messages_purged"] == 5
+
+
+def test_each_session_is_claimed_by_one_worker(db, monkeypatch):
+    first, second = SessionPurger(db), SessionPurger(db)
+
+    async def scenario():
+        await add_session(db, "old")
+        await add_session(db, "new")
+        await db.chat_sessions.update_one({"id": "old"}, {"$set": {"deleted_at": datetime(2024, 1, 1)}})
+        await db.chat_sessions.update_one({"id": "new"}, {"$set": {"deleted_at": datetime(2024, 1, 2)}})
+        claims = [await first.claim_next(), await second.claim_next()]
+        # A worker resumes its own claim, but cannot take the other's
+        await db.chat_sessions.delete_one({"id": "old"})
+        claims += [await second.claim_next(), await first.claim_next()]
+        return claims
+
+    assert run(scenario()) == ["old", "new", "new", None]
+
+
+def test_expired_claim_is_taken_over(db, purger, monkeypatch):
+    other = SessionPurger(db)
+
+    async def scenario():
+        await add_session(db, "s1", messages=4)
+        await purger.tombstone({"id": "s1"})
+        assert await purger.claim_next() == "s1"
+        # The first worker stalls past its lease
+        await db.chat_sessions.update_one(
+            {"id": "s1"}, {"$set": {"purge_lease_until": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        assert await other.claim_next() == "s1"
+        # The stalled worker notices it lost the claim after its current batch
+        lost = await purger.purge_session("s1")
+        finished = await other.purge_session("s1")
+        return lost, finished, await db.chat_messages.count_documents({})
+
+    assert run(scenario()) == (False, True, 0)
+
+
+def test_status_is_shared_between_workers(db, purger):
+    other = SessionPurger(db)
+
+    async def scenario():
+        await add_session(db, "s1", messages=3)
+        await add_session(db, "s2", messages=1)
+        await purger.tombstone({"id": {"$in": ["s1", "s2"]}})
+        assert await purger.claim_next() is not None
+        during = await other.get_status("s1")
+        await purger.purge_pending()
+        return during, await other.get_status()
+
+    during, after = run(scenario())
+    assert during["pending_sessions"] == 2
+    assert len(during["purging_sessions"]) == 1
+    assert during["session"]["state"] == "purging"
+    assert after["sessions_purged"] == 2
+    assert after["messages_purged"] == 4
+    assert after["last_run_at"] is not None
+
+
+def request(app, method: str, url: str, **kwargs):
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            return await client.request(method, url, **kwargs)
+
+    return asyncio.run(send())
+
+
+def test_deleted_session_disappears_from_api(db, make_app):
+    app = make_app()
+    run(add_session(db, "s1", messages=2))
+
+    assert request(app, "DELETE", "/api/chat/session/s1").status_code == 200
+    assert request(app, "DELETE", "/api/chat/session/s1").status_code == 404
+    assert request(app, "GET", "/api/chat/history/s1").status_code == 404
+    assert request(app, "GET", "/api/chat/sessions").json() == {"sessions": []}
+
+    status = request(app, "GET", "/api/chat/sessions/purge-status", params={"session_id": "s1"}).json()
+    assert status["session"]["state"] == "purging"
+    assert status["session"]["messages_remaining"] == 2
+
+
+def test_bulk_delete_by_ids_and_age(db, make_app):
+    app = make_app()
+
+    async def setup():
+        await add_session(db, "a")
+        await add_session(db, "b")
+        await add_session(db, "stale", updated_at=datetime.utcnow() - timedelta(days=40))
+
+    run(setup())
+    response = request(app, "POST", "/api/chat/sessions/delete", json={"session_ids": ["a", "missing"]})
+    assert response.json()["deleted_count"] == 1
+    response = request(app, "POST", "/api/chat/sessions/delete", json={"older_than_days": 30})
+    assert response.json()["deleted_count"] == 1
+    assert request(app, "POST", "/api/chat/sessions/delete", json={}).status_code == 400
+    assert request(app, "POST", "/api/chat/sessions/delete", json={"older_than_days": -1}).status_code == 400
+
+    remaining = run(db.chat_sessions.find({"deleted_at": None}, {"id": 1}).to_list(length=10))
+    assert [session["id"] for session in remaining] == ["b"]
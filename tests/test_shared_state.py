@@ -0,0 +1,159 @@
+import os
+import signal
+import time
+
+import pytest
+
+import shared_state
+from shared_state import KEY_SIZE, ModelLatencyStats, ProcessLock, SharedTable, SharedTableBusy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_state.time, "time", lambda: now[0])
+    return now
+
+
+def put(table: SharedTable, key: str, *values: float):
+    table.update(key, lambda old: values)
+
+
+def test_update_creates_then_replaces_record():
+    table = SharedTable(slots=64)
+    seen = []
+
+    def increment(old):
+        seen.append(old)
+        return ((old[0] if old else 0.0) + 1,)
+
+    table.update("k", increment)
+    table.update("k", increment)
+    assert seen == [None, (1.0, 0.0, 0.0, 0.0)]
+    # Missing values are padded with zeros
+    assert table.get("k") == (2.0, 0.0, 0.0, 0.0)
+    assert table.get("missing") is None
+
+
+def test_colliding_keys_probe_to_free_slots():
+    table = SharedTable(slots=4)
+    for i in range(4):
+        put(table, f"k{i}", float(i))
+    assert [table.get(f"k{i}")[0] for i in range(4)] == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_full_probe_window_evicts_stalest_record(clock):
+    table = SharedTable(slots=4)
+    for i in range(4):
+        clock[0] += 1
+        put(table, f"k{i}", float(i))
+    # Touch k0 so k1 becomes the stalest
+    clock[0] += 1
+    put(table, "k0", 10.0)
+
+    clock[0] += 1
+    put(table, "new", 99.0)
+    assert table.get("new")[0] == 99.0
+    assert table.get("k1") is None
+    assert {table.get(key)[0] for key in ("k0", "k2", "k3")} == {10.0, 2.0, 3.0}
+
+
+def test_long_keys_are_digested_but_stay_distinct():
+    table = SharedTable(slots=64)
+    prefix = "x" * (KEY_SIZE + 10)
+    put(table, prefix + "a", 1.0)
+    put(table, prefix + "b", 2.0)
+    assert table.get(prefix + "a")[0] == 1.0
+    assert table.get(prefix + "b")[0] == 2.0
+
+
+def test_items_filters_by_prefix():
+    table = SharedTable(slots=64)
+    put(table, "latency:a", 1.0)
+    put(table, "worker:1", 2.0)
+    assert table.items("latency:") == [("latency:a", (1.0, 0.0, 0.0, 0.0))]
+    assert len(table.items()) == 2
+
+
+def test_busy_lock_raises_after_timeout():
+    lock = ProcessLock()
+    table = SharedTable(slots=64, lock=lock)
+    table.lock_timeout = 0.01
+
+    pid = os.fork()
+    if pid == 0:
+        lock.acquire(timeout=1)
+        time.sleep(2)
+        os._exit(0)
+    try:
+        # Give the child time to take the lock
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            try:
+                table.get("k")
+            except SharedTableBusy:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("lock held by another process was not detected")
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def test_lock_of_killed_worker_is_released():
+    lock = ProcessLock()
+    table = SharedTable(slots=64, lock=lock)
+    read, write = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        lock.acquire(timeout=1)
+        os.write(write, b"x")
+        time.sleep(10)
+        os._exit(0)
+    os.read(read, 1)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+    put(table, "k", 1.0)
+    assert table.get("k")[0] == 1.0
+
+
+def test_updates_from_forked_workers_are_shared():
+    lock = ProcessLock()
+    table = SharedTable(slots=64, lock=lock)
+    children = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:
+            for _ in range(100):
+                table.update("count", lambda old: ((old[0] if old else 0.0) + 1,))
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+    assert table.get("count")[0] == 400.0
+
+
+def test_latency_stats_snapshot():
+    stats = ModelLatencyStats(SharedTable(slots=64))
+    stats.record("openai/gpt-4o", 100.0)
+    stats.record("openai/gpt-4o", 300.0, failed=True)
+
+    snapshot = stats.snapshot()
+    assert snapshot["models"] == {"openai/gpt-4o": {"count": 2, "mean_ms": 200.0, "max_ms": 300.0, "errors": 1}}
+    assert snapshot["workers"][str(os.getpid())]["count"] == 2
+
+
+def test_latency_stats_drop_samples_when_table_is_busy():
+    table = SharedTable(slots=64, lock=ProcessLock())
+    table.lock_timeout = 0.01
+    stats = ModelLatencyStats(table)
+    table.lock.acquire(timeout=1)
+    try:
+        # Another thread of this worker holds the lock; recording must not raise
+        stats.record("openai/gpt-4o", 100.0)
+    finally:
+        table.lock.release()
+    assert stats.snapshot()["models"] == {}